@@ -6,14 +6,19 @@ import time
 import json
 import re
 import logging
+import sqlite3
 import aiohttp
 from telegram import Update, ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, CallbackContext, CallbackQueryHandler
 from datetime import datetime, timedelta
-from telegram.error import BadRequest
+from telegram.error import BadRequest, RetryAfter
 from fastapi import FastAPI
 import uvicorn
 import random
+import heapq
+import itertools
+from collections import deque
+from contextlib import contextmanager
 from typing import Dict, List, Optional, Tuple
 import jwt
 
@@ -42,21 +47,173 @@ BASE_URL = os.environ.get("BASE_URL", "http://8.222.182.223:8081")
 # Render-compatible port
 RENDER_PORT = int(os.environ.get("PORT", 10000))
 
-# File paths with Render.com compatibility
-if 'RENDER' in os.environ:
-    ACCOUNTS_FILE = "/tmp/accounts.json"
-    STATS_FILE = "/tmp/stats.json"
-    OTP_STATS_FILE = "/tmp/otp_stats.json"
-    SETTINGS_FILE = "/tmp/settings.json"
-else:
-    ACCOUNTS_FILE = "accounts.json"
-    STATS_FILE = "stats.json"
-    OTP_STATS_FILE = "otp_stats.json"
-    SETTINGS_FILE = "settings.json"
+# Data directory, resolved once at startup: DATA_DIR overrides, Render keeps data
+# in /tmp, otherwise the working directory; the first writable candidate wins
+def resolve_data_dir():
+    candidates = []
+    if os.environ.get("DATA_DIR"):
+        candidates.append(os.environ["DATA_DIR"])
+    if 'RENDER' in os.environ:
+        candidates.append("/tmp")
+    candidates += [".", "/tmp"]
+    for path in dict.fromkeys(candidates):
+        try:
+            os.makedirs(path, exist_ok=True)
+            probe = os.path.join(path, f".write-test-{os.getpid()}")
+            with open(probe, 'w', encoding='utf-8') as f:
+                f.write("ok")
+            os.remove(probe)
+            return os.path.abspath(path)
+        except OSError as e:
+            print(f"⚠️ Data directory {path} is not writable: {e}")
+    raise RuntimeError(f"No writable data directory among {candidates}")
+
+DATA_DIR = resolve_data_dir()
+print(f"💾 Data directory: {DATA_DIR}")
+
+DB_FILE = os.path.join(DATA_DIR, "wsotp.db")
+# Legacy JSON files, only read by the one-time import into DB_FILE
+ACCOUNTS_FILE = os.path.join(DATA_DIR, "accounts.json")
+STATS_FILE = os.path.join(DATA_DIR, "stats.json")
+OTP_STATS_FILE = os.path.join(DATA_DIR, "otp_stats.json")
+SETTINGS_FILE = os.path.join(DATA_DIR, "settings.json")
+TRACKING_FILE = os.path.join(DATA_DIR, "tracking.json")
+# Append-only journal of counted events and the per-day archive of compacted ones
+JOURNAL_FILE = os.path.join(DATA_DIR, "events.jsonl")
+JOURNAL_ARCHIVE_DIR = os.path.join(DATA_DIR, "journal")
 
 USD_TO_BDT = 125  # Exchange rate
 MAX_PER_ACCOUNT = 5
 
+# Panel connection pool
+PANEL_POOL_LIMIT = int(os.environ.get("PANEL_POOL_LIMIT", "100"))
+PANEL_POOL_PER_HOST = int(os.environ.get("PANEL_POOL_PER_HOST", "50"))
+PANEL_KEEPALIVE = float(os.environ.get("PANEL_KEEPALIVE", "30"))
+PANEL_DNS_TTL = int(os.environ.get("PANEL_DNS_TTL", "300"))
+
+# Panel request budget (requests/second) and adaptive concurrency bounds
+PANEL_RATE = float(os.environ.get("PANEL_RATE", "20"))
+PANEL_BURST = float(os.environ.get("PANEL_BURST", "40"))
+PANEL_ACCOUNT_RATE = float(os.environ.get("PANEL_ACCOUNT_RATE", "2"))
+PANEL_ACCOUNT_BURST = float(os.environ.get("PANEL_ACCOUNT_BURST", "5"))
+PANEL_CONCURRENCY = int(os.environ.get("PANEL_CONCURRENCY", "16"))
+PANEL_CONCURRENCY_MIN = int(os.environ.get("PANEL_CONCURRENCY_MIN", "4"))
+PANEL_CONCURRENCY_MAX = int(os.environ.get("PANEL_CONCURRENCY_MAX", "64"))
+PANEL_LATENCY_TARGET = float(os.environ.get("PANEL_LATENCY_TARGET", "2.0"))
+
+# OTP priority lane: its own connection pool and concurrency slots that
+# routine polling can never occupy
+PANEL_PRIORITY_POOL = int(os.environ.get("PANEL_PRIORITY_POOL", "8"))
+PANEL_PRIORITY_SLOTS = int(os.environ.get("PANEL_PRIORITY_SLOTS", "4"))
+
+# Add pipeline: workers running number adds, queue size before senders wait,
+# and how long shutdown waits for queued adds to finish
+ADD_WORKERS = int(os.environ.get("ADD_WORKERS", "16"))
+ADD_QUEUE_SIZE = int(os.environ.get("ADD_QUEUE_SIZE", "1000"))
+ADD_DRAIN_TIMEOUT = float(os.environ.get("ADD_DRAIN_TIMEOUT", "20"))
+
+# Fair scheduling: queued panel calls are served per user in deficit round robin;
+# a user's weight (admin /setweight, default below) is their share per round
+FAIR_DEFAULT_WEIGHT = float(os.environ.get("FAIR_DEFAULT_WEIGHT", "1"))
+FAIR_MAX_WEIGHT = float(os.environ.get("FAIR_MAX_WEIGHT", "20"))
+
+# Stats counters live in memory; changes are written to the database at most
+# once per this many seconds (and on shutdown)
+COUNTER_FLUSH_DELAY = float(os.environ.get("COUNTER_FLUSH_DELAY", "2"))
+
+# Database writes run on one background thread: attempts per write before it is
+# dropped, base delay between attempts, and how long shutdown waits for the queue
+STORAGE_WRITE_ATTEMPTS = int(os.environ.get("STORAGE_WRITE_ATTEMPTS", "3"))
+STORAGE_RETRY_DELAY = float(os.environ.get("STORAGE_RETRY_DELAY", "0.5"))
+STORAGE_STOP_TIMEOUT = float(os.environ.get("STORAGE_STOP_TIMEOUT", "10"))
+
+# Event journal: how often events already in the database are compacted out of
+# events.jsonl, and whether compacted events are kept in journal/events-<day>.jsonl
+JOURNAL_COMPACT_INTERVAL = float(os.environ.get("JOURNAL_COMPACT_INTERVAL", "300"))
+JOURNAL_ARCHIVE = os.environ.get("JOURNAL_ARCHIVE", "1").lower() in ("1", "true", "yes")
+
+# Panel circuit breaker
+BREAKER_WINDOW = float(os.environ.get("BREAKER_WINDOW", "30"))
+BREAKER_MIN_REQUESTS = int(os.environ.get("BREAKER_MIN_REQUESTS", "10"))
+BREAKER_ERROR_RATE = float(os.environ.get("BREAKER_ERROR_RATE", "0.5"))
+BREAKER_OPEN_SECONDS = float(os.environ.get("BREAKER_OPEN_SECONDS", "20"))
+BREAKER_HALF_OPEN_PROBES = int(os.environ.get("BREAKER_HALF_OPEN_PROBES", "2"))
+
+# How long a finished status/login result may be reused by identical requests
+STATUS_SINGLEFLIGHT_TTL = float(os.environ.get("STATUS_SINGLEFLIGHT_TTL", "0.5"))
+LOGIN_SINGLEFLIGHT_TTL = float(os.environ.get("LOGIN_SINGLEFLIGHT_TTL", "5"))
+
+# Token validity: trust JWTs until this many seconds before exp, and for
+# tokens without exp, for this long after their last successful call
+TOKEN_EXPIRY_SKEW = float(os.environ.get("TOKEN_EXPIRY_SKEW", "300"))
+TOKEN_OK_TTL = float(os.environ.get("TOKEN_OK_TTL", "600"))
+
+# Token keeper: re-login this many seconds before a JWT expires, checking every
+# TOKEN_KEEPER_INTERVAL, at most TOKEN_KEEPER_CONCURRENCY logins at a time
+TOKEN_REFRESH_AHEAD = float(os.environ.get("TOKEN_REFRESH_AHEAD", "900"))
+TOKEN_KEEPER_INTERVAL = float(os.environ.get("TOKEN_KEEPER_INTERVAL", "60"))
+TOKEN_KEEPER_CONCURRENCY = int(os.environ.get("TOKEN_KEEPER_CONCURRENCY", "3"))
+TOKEN_KEEPER_STAGGER = float(os.environ.get("TOKEN_KEEPER_STAGGER", "0.5"))
+# Failed keeper logins back off exponentially (base, cap); after TOKEN_KEEPER_MAX_FAILURES
+# the account waits for a manual refresh or a new token
+TOKEN_KEEPER_BACKOFF = float(os.environ.get("TOKEN_KEEPER_BACKOFF", "60"))
+TOKEN_KEEPER_BACKOFF_MAX = float(os.environ.get("TOKEN_KEEPER_BACKOFF_MAX", "3600"))
+TOKEN_KEEPER_MAX_FAILURES = int(os.environ.get("TOKEN_KEEPER_MAX_FAILURES", "5"))
+
+# Account initialization: accounts validated/logged in at once per user, and
+# the most one account may take before it is counted as failed
+INIT_CONCURRENCY = int(os.environ.get("INIT_CONCURRENCY", "8"))
+INIT_ACCOUNT_TIMEOUT = float(os.environ.get("INIT_ACCOUNT_TIMEOUT", "35"))
+
+# Boot warm-up: load every user's token pool at startup instead of waiting for /start
+BOOT_WARMUP = os.environ.get("BOOT_WARMUP", "0").lower() in ("1", "true", "yes")
+BOOT_WARMUP_CONCURRENCY = int(os.environ.get("BOOT_WARMUP_CONCURRENCY", "8"))
+BOOT_WARMUP_STAGGER = float(os.environ.get("BOOT_WARMUP_STAGGER", "0.2"))
+
+# Deferred sends (group notifications): queued messages and delivery attempts
+DEFERRED_QUEUE_SIZE = int(os.environ.get("DEFERRED_QUEUE_SIZE", "500"))
+DEFERRED_SEND_ATTEMPTS = int(os.environ.get("DEFERRED_SEND_ATTEMPTS", "3"))
+
+# Batched status polling
+STATUS_POLL_INTERVAL = float(os.environ.get("STATUS_POLL_INTERVAL", "1"))
+STATUS_POLL_PAGE_SIZE = int(os.environ.get("STATUS_POLL_PAGE_SIZE", "100"))
+STATUS_POLL_MAX_PAGES = int(os.environ.get("STATUS_POLL_MAX_PAGES", "5"))
+
+# Status tracking backoff
+TRACK_DEADLINE_SECONDS = float(os.environ.get("TRACK_DEADLINE_SECONDS", "180"))
+TRACK_FAST_WINDOW = float(os.environ.get("TRACK_FAST_WINDOW", "15"))
+TRACK_FAST_INTERVAL = float(os.environ.get("TRACK_FAST_INTERVAL", "1"))
+TRACK_BACKOFF_FACTOR = float(os.environ.get("TRACK_BACKOFF_FACTOR", "1.5"))
+TRACK_BACKOFF_JITTER = float(os.environ.get("TRACK_BACKOFF_JITTER", "0.2"))
+
+# status_code -> (base interval, max interval) in seconds while the status stays the same
+TRACK_BACKOFF_POLICY = {
+    None: (1, 5),     # Not visible on the panel yet
+    2: (2, 15),       # In Progress - waiting for the user's OTP
+    5: (1, 10),       # Pending Verification
+    14: (1, 8),       # Processing
+    -2: (2, 20),      # API Error / Refresh Server
+}
+TRACK_BACKOFF_DEFAULT = (1, 10)
+if os.environ.get("TRACK_BACKOFF_POLICY"):
+    # e.g. TRACK_BACKOFF_POLICY='{"2": [3, 20], "5": [1, 6]}'
+    try:
+        for code, (base, cap) in json.loads(os.environ["TRACK_BACKOFF_POLICY"]).items():
+            TRACK_BACKOFF_POLICY[None if code == "null" else int(code)] = (float(base), float(cap))
+    except Exception as e:
+        print(f"⚠️ Invalid TRACK_BACKOFF_POLICY, using defaults: {e}")
+
+# Slot leases: a number's account slot is reclaimed this long after its
+# tracking deadline if nothing released it; the reaper checks every interval
+SLOT_LEASE_GRACE = float(os.environ.get("SLOT_LEASE_GRACE", "120"))
+SLOT_REAPER_INTERVAL = float(os.environ.get("SLOT_REAPER_INTERVAL", "30"))
+
+# Waiting queue for numbers sent while every slot is busy: per-user cap,
+# how long a number may wait, and how often the queue is re-checked
+WAIT_QUEUE_MAX = int(os.environ.get("WAIT_QUEUE_MAX", "500"))
+WAIT_QUEUE_TTL = float(os.environ.get("WAIT_QUEUE_TTL", "1800"))
+WAIT_QUEUE_INTERVAL = float(os.environ.get("WAIT_QUEUE_INTERVAL", "5"))
+
 
 # Status map
 status_map = {
@@ -148,276 +305,766 @@ async def immediate_ping():
         print(f"⚠️ Immediate ping failed: {e}")
 
 
-# tracking.json ফাইল অপারেশন
-def load_tracking():
-    try:
-        with open("tracking.json", 'r', encoding='utf-8') as f:
-            data = json.load(f)
-            # Ensure proper structure
-            if "today_added" not in data or not isinstance(data["today_added"], dict):
-                data["today_added"] = {}
-            if "yesterday_added" not in data or not isinstance(data["yesterday_added"], dict):
-                data["yesterday_added"] = {}
-            if "today_success" not in data or not isinstance(data["today_success"], dict):
-                data["today_success"] = {}
-            if "yesterday_success" not in data or not isinstance(data["yesterday_success"], dict):
-                data["yesterday_success"] = {}
-            if "today_success_counts" not in data or not isinstance(data["today_success_counts"], dict):
-                data["today_success_counts"] = {}
-            if "daily_stats" not in data or not isinstance(data["daily_stats"], dict):
-                data["daily_stats"] = {}
-            return data
-    except:
-        # Default structure
+# SQLite storage - accounts, counters, success events and settings in one WAL database
+COUNTER_UPSERT = (
+    "INSERT INTO counters (name, user_id, value) VALUES (?, ?, ?) "
+    "ON CONFLICT(name, user_id) DO UPDATE SET value = value + excluded.value"
+)
+ACCOUNT_UPSERT = (
+    "INSERT INTO accounts (user_id, username, position, data) VALUES (?, ?, ?, ?) "
+    "ON CONFLICT(user_id, username) DO UPDATE SET position = excluded.position, data = excluded.data"
+)
+OTP_FIELDS = {'otp_total': 'total_success', 'otp_today': 'today_success', 'otp_yesterday': 'yesterday_success'}
+
+def _read_legacy_json(file_path):
+    # Older deployments kept the files in the working directory or /tmp regardless of DATA_DIR
+    name = os.path.basename(file_path)
+    possible_paths = dict.fromkeys([file_path, name, os.path.join("/tmp", name)])
+    for file_path in possible_paths:
+        try:
+            if os.path.exists(file_path):
+                with open(file_path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                if isinstance(data, dict):
+                    print(f"✅ Loaded legacy data from {file_path}")
+                    return data
+        except Exception as e:
+            print(f"❌ Error loading from {file_path}: {e}")
+    return {}
+
+def _count_map(data):
+    if not isinstance(data, dict):
+        return {}
+    return {str(k): int(v) for k, v in data.items() if isinstance(v, (int, float)) and v}
+
+class Storage:
+    # today's counter -> the yesterday counter it becomes at the daily reset
+    ROLLOVER = {
+        'checked_today': 'checked_yesterday',
+        'deleted_today': 'deleted_yesterday',
+        'otp_today': 'otp_yesterday',
+        'added_today': 'added_yesterday',
+        'success_count_today': 'success_count_yesterday',
+    }
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS accounts (
+            user_id TEXT NOT NULL,
+            username TEXT NOT NULL,
+            position INTEGER NOT NULL,
+            data TEXT NOT NULL,
+            PRIMARY KEY (user_id, username)
+        );
+        CREATE TABLE IF NOT EXISTS counters (
+            name TEXT NOT NULL,
+            user_id TEXT NOT NULL DEFAULT '',
+            value INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (name, user_id)
+        );
+        CREATE TABLE IF NOT EXISTS success_events (
+            period INTEGER NOT NULL,
+            phone TEXT NOT NULL,
+            user_id TEXT NOT NULL,
+            at TEXT NOT NULL,
+            PRIMARY KEY (period, phone)
+        );
+        CREATE TABLE IF NOT EXISTS daily_stats (
+            day TEXT NOT NULL,
+            user_id TEXT NOT NULL,
+            success INTEGER NOT NULL,
+            PRIMARY KEY (day, user_id)
+        );
+        CREATE TABLE IF NOT EXISTS otp_users (
+            user_id TEXT PRIMARY KEY,
+            username TEXT,
+            full_name TEXT
+        );
+        CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+        CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.RLock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("PRAGMA busy_timeout=5000")
+        self.conn.executescript(self.SCHEMA)
+        self._account_rows = {}  # (user_id, username) -> (position, data) as last written
+        self.unsaved = set()  # first journal seq of each counter batch that failed (storage thread only)
+        self.period = int(self.get_meta('period', '0'))  # bumped by every daily reset
+    
+    @contextmanager
+    def transaction(self):
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self.conn
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+            self.conn.execute("COMMIT")
+    
+    def query(self, sql, args=()):
+        with self.lock:
+            return self.conn.execute(sql, args).fetchall()
+    
+    def get_meta(self, key, default=None):
+        rows = self.query("SELECT value FROM meta WHERE key = ?", (key,))
+        return rows[0][0] if rows else default
+    
+    def _set_meta(self, conn, key, value):
+        conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, str(value)))
+    
+    # Counters
+    def load_counters(self):
+        """Everything the in-memory counter cache starts from"""
         return {
-            "added_numbers": {},
-            "success_numbers": {},
-            "today_added": {},
-            "yesterday_added": {},
-            "today_success": {},
-            "yesterday_success": {},
-            "today_success_counts": {},
-            "daily_stats": {},
-            "last_reset": datetime.now().isoformat()
+            'values': {(name, user_id): value for name, user_id, value in self.query("SELECT name, user_id, value FROM counters")},
+            'success_today': dict(self.query("SELECT phone, user_id FROM success_events WHERE period = ?", (self.period,))),
+            'otp_users': {user_id: (username, full_name) for user_id, username, full_name in self.query("SELECT user_id, username, full_name FROM otp_users")},
+            'daily_stats': self.query("SELECT day, user_id, success FROM daily_stats"),
+            'last_reset': self.get_meta('last_reset', datetime.now().isoformat()),
         }
+    
+    def _safe_seq(self, seq, unsaved):
+        # journal_seq may not pass a batch that failed and is still waiting to be rewritten
+        return min(seq, min(unsaved) - 1) if unsaved else seq
+    
+    def apply(self, changes, events, users, seq, carried=()):
+        """Write a batch of counter deltas, success events and new OTP users in one transaction;
+        seq is the last journal event the batch covers, carried the failed batches it re-sends"""
+        unsaved = self.unsaved - set(carried)
+        with self.transaction() as conn:
+            conn.executemany(COUNTER_UPSERT, [(name, user_id, delta) for (name, user_id), delta in changes.items() if delta])
+            conn.executemany(
+                "INSERT OR IGNORE INTO success_events (period, phone, user_id, at) VALUES (?, ?, ?, ?)",
+                [(self.period, phone, user_id, at) for phone, user_id, at in events]
+            )
+            conn.executemany(
+                "INSERT OR IGNORE INTO otp_users (user_id, username, full_name) VALUES (?, ?, ?)",
+                [(user_id, username, full_name) for user_id, (username, full_name) in users.items()]
+            )
+            self._set_meta(conn, 'journal_seq', self._safe_seq(seq, unsaved))
+        self.unsaved = unsaved
+    
+    def rollover(self, day, at, seq):
+        """Daily reset: snapshot today's successes under day and shift every today counter to yesterday"""
+        with self.transaction() as conn:
+            conn.execute("DELETE FROM daily_stats WHERE day = ?", (day,))
+            conn.execute(
+                "INSERT INTO daily_stats (day, user_id, success) "
+                "SELECT ?, user_id, value FROM counters WHERE name = 'success_count_today' AND user_id != ''",
+                (day,)
+            )
+            for today, yesterday in self.ROLLOVER.items():
+                conn.execute("DELETE FROM counters WHERE name = ?", (yesterday,))
+                conn.execute("UPDATE counters SET name = ? WHERE name = ?", (yesterday, today))
+            period = self.period + 1
+            conn.execute("DELETE FROM success_events WHERE period < ?", (period,))
+            self._set_meta(conn, 'period', period)
+            self._set_meta(conn, 'last_reset', at)
+            self._set_meta(conn, 'journal_seq', self._safe_seq(seq, self.unsaved))
+            self.period = period
+    
+    # Accounts
+    def load_accounts(self):
+        accounts = {}
+        rows = {}
+        for user_id_str, username, position, data in self.query("SELECT user_id, username, position, data FROM accounts ORDER BY rowid"):
+            accounts.setdefault(user_id_str, []).append((position, json.loads(data)))
+            rows[(user_id_str, username)] = (position, data)
+        self._account_rows = rows
+        return {user_id_str: [acc for _, acc in sorted(entries, key=lambda e: e[0])] for user_id_str, entries in accounts.items()}
+    
+    def _write_accounts(self, conn, accounts):
+        rows = {}
+        for user_id_str, user_accounts in accounts.items():
+            for position, acc in enumerate(user_accounts):
+                rows[(user_id_str, acc['username'])] = (position, json.dumps(acc, ensure_ascii=False))
+        stale = [key for key in self._account_rows if key not in rows]
+        changed = [(key[0], key[1], position, data) for key, (position, data) in rows.items()
+                   if self._account_rows.get(key) != (position, data)]
+        conn.executemany("DELETE FROM accounts WHERE user_id = ? AND username = ?", stale)
+        conn.executemany(ACCOUNT_UPSERT, changed)
+        return rows, len(stale) + len(changed)
+    
+    def save_accounts(self, accounts):
+        """Write only the account rows that changed since the last load/save"""
+        with self.transaction() as conn:
+            rows, written = self._write_accounts(conn, accounts)
+        self._account_rows = rows
+        return written
+    
+    # Settings
+    def load_settings(self):
+        return {key: json.loads(value) for key, value in self.query("SELECT key, value FROM settings")}
+    
+    def save_settings(self, settings):
+        with self.transaction() as conn:
+            conn.execute("DELETE FROM settings")
+            conn.executemany(
+                "INSERT INTO settings (key, value) VALUES (?, ?)",
+                [(key, json.dumps(value, ensure_ascii=False)) for key, value in settings.items()]
+            )
+    
+    def import_json(self):
+        """One-time import of accounts/stats/otp_stats/tracking/settings JSON files"""
+        if self.get_meta('json_imported'):
+            return False
+        accounts = _read_legacy_json(ACCOUNTS_FILE)
+        stats = _read_legacy_json(STATS_FILE)
+        otp_stats = _read_legacy_json(OTP_STATS_FILE)
+        tracking = _read_legacy_json(TRACKING_FILE)
+        settings = _read_legacy_json(SETTINGS_FILE)
+        
+        changes = []
+        for field, name in (('total_checked', 'checked_total'), ('today_checked', 'checked_today'),
+                            ('yesterday_checked', 'checked_yesterday'), ('total_deleted', 'deleted_total'),
+                            ('today_deleted', 'deleted_today'), ('yesterday_deleted', 'deleted_yesterday')):
+            changes.append((name, '', _count_map(stats).get(field, 0)))
+        for name, field in OTP_FIELDS.items():
+            changes.append((name, '', _count_map(otp_stats).get(field, 0)))
+        user_stats = otp_stats.get('user_stats', {})
+        user_stats = user_stats if isinstance(user_stats, dict) else {}
+        for user_id_str, info in user_stats.items():
+            for name, field in OTP_FIELDS.items():
+                changes.append((name, str(user_id_str), _count_map(info).get(field, 0)))
+        for field, name in (('today_added', 'added_today'), ('yesterday_added', 'added_yesterday'),
+                            ('today_success_counts', 'success_count_today'), ('yesterday_success', 'success_count_yesterday')):
+            for user_id_str, value in _count_map(tracking.get(field)).items():
+                changes.append((name, user_id_str, value))
+        today_success = tracking.get('today_success')
+        today_success = today_success if isinstance(today_success, dict) else {}
+        daily_stats = tracking.get('daily_stats')
+        daily_stats = daily_stats if isinstance(daily_stats, dict) else {}
+        now = datetime.now().isoformat()
+        
+        with self.transaction() as conn:
+            rows, _ = self._write_accounts(conn, {str(k): v for k, v in accounts.items() if isinstance(v, list)})
+            conn.executemany(COUNTER_UPSERT, [change for change in changes if change[2]])
+            conn.executemany(
+                "INSERT OR REPLACE INTO otp_users (user_id, username, full_name) VALUES (?, ?, ?)",
+                [(str(k), info.get('username'), info.get('full_name', '')) for k, info in user_stats.items() if isinstance(info, dict)]
+            )
+            conn.executemany(
+                "INSERT OR IGNORE INTO success_events (period, phone, user_id, at) VALUES (?, ?, ?, ?)",
+                [(self.period, str(phone), str(user_id_str), now) for phone, user_id_str in today_success.items()]
+            )
+            conn.executemany(
+                "INSERT OR REPLACE INTO daily_stats (day, user_id, success) VALUES (?, ?, ?)",
+                [(day, user_id_str, value) for day, counts in daily_stats.items() for user_id_str, value in _count_map(counts).items()]
+            )
+            conn.executemany(
+                "INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)",
+                [(key, json.dumps(value, ensure_ascii=False)) for key, value in settings.items()]
+            )
+            self._set_meta(conn, 'last_reset', stats.get('last_reset') or tracking.get('last_reset') or now)
+            self._set_meta(conn, 'json_imported', now)
+        self._account_rows = rows
+        print(f"✅ Imported JSON data into {self.path} ({len(rows)} accounts, {len(changes)} counters)")
+        return True
 
-def save_tracking(tracking):
-    try:
-        with open("tracking.json", 'w', encoding='utf-8') as f:
-            json.dump(tracking, f, indent=4, ensure_ascii=False)
-    except Exception as e:
-        print(f"❌ Error saving tracking: {e}")
+storage = Storage(DB_FILE)
+storage.import_json()
 
-async def reset_daily_stats(context: CallbackContext):
-    stats = load_stats()
-    otp_stats = load_otp_stats()
-    tracking = load_tracking()
-    
-    # Get today's date
-    today_date = datetime.now().date().isoformat()
+# Storage writer - every database write runs on one thread so the event loop never waits on disk
+class StorageWriter:
+    def __init__(self, attempts, retry_delay):
+        self.attempts = attempts
+        self.retry_delay = retry_delay
+        self.jobs = deque()  # [fn, args, key]
+        self.keyed = {}  # key -> queued job; a newer submit replaces its args
+        self.cond = threading.Condition()
+        self.busy = False
+        self.closed = False
+        self.thread = None
+        self.written = 0
+        self.coalesced = 0
+        self.failed = 0
+    
+    def start(self):
+        """Start the writer thread, or reopen it after stop() (the bot restarts in-process)"""
+        with self.cond:
+            self.closed = False
+        if self.thread is None or not self.thread.is_alive():
+            self.thread = threading.Thread(target=self._run, name="storage-writer", daemon=True)
+            self.thread.start()
+    
+    def submit(self, fn, *args, key=None, on_failure=None):
+        """Queue fn(*args); jobs sharing a key collapse into the latest one while still queued.
+        on_failure() runs on the storage thread once every attempt has failed"""
+        with self.cond:
+            if key is not None and key in self.keyed:
+                self.keyed[key][1] = args
+                self.coalesced += 1
+                return
+            job = [fn, args, key, on_failure]
+            self.jobs.append(job)
+            if key is not None:
+                self.keyed[key] = job
+            self.cond.notify_all()
+    
+    def pending(self):
+        return len(self.jobs) + (1 if self.busy else 0)
+    
+    def _run(self):
+        while True:
+            with self.cond:
+                while not self.jobs and not self.closed:
+                    self.cond.wait()
+                if not self.jobs:
+                    return
+                fn, args, key, on_failure = self.jobs.popleft()
+                if key is not None:
+                    self.keyed.pop(key, None)
+                self.busy = True
+            try:
+                if not self._execute(fn, args) and on_failure is not None:
+                    try:
+                        on_failure()
+                    except Exception as e:
+                        print(f"❌ Storage failure handler for {fn.__name__} failed: {e}")
+            finally:
+                with self.cond:
+                    self.busy = False
+                    self.cond.notify_all()
+    
+    def _execute(self, fn, args):
+        for attempt in range(1, self.attempts + 1):
+            try:
+                fn(*args)
+                self.written += 1
+                return True
+            except Exception as e:
+                print(f"❌ Storage write {fn.__name__} failed (attempt {attempt}/{self.attempts}): {e}")
+                if attempt < self.attempts:
+                    time.sleep(self.retry_delay * attempt)
+        self.failed += 1
+        return False
     
-    # Save today's added stats to yesterday
-    tracking["yesterday_added"] = tracking.get("today_added", {}).copy()
+    def wait_idle(self, timeout=None):
+        """Block until everything queued so far is written (or timeout)"""
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        with self.cond:
+            while self.jobs or self.busy:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self.cond.wait(remaining)
+        return True
     
-    # Save today's success stats to daily_stats
-    if "daily_stats" not in tracking:
-        tracking["daily_stats"] = {}
+    def stop(self, timeout):
+        """Finish the queue and stop the thread"""
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+        if self.thread is not None:
+            self.thread.join(timeout)
+        return not self.jobs
+
+storage_writer = StorageWriter(STORAGE_WRITE_ATTEMPTS, STORAGE_RETRY_DELAY)
+storage_writer.start()
+
+# Event journal - counted events are appended to a JSONL file as they happen; the database is the
+# snapshot, compaction drops events it already covers, and startup replays the rest
+class EventJournal:
+    def __init__(self, storage, path, archive_dir, archive):
+        self.storage = storage
+        self.path = path
+        self.archive_dir = archive_dir
+        self.archive = archive
+        self.lock = threading.Lock()
+        self.buffer = []  # lines waiting for the storage thread
+        self.file = None
+        self.appended = 0
+        self.compactions = 0
+        self.last_compaction = None
+    
+    def read(self):
+        events = []
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        events.append(json.loads(line))
+                    except ValueError:
+                        # A crash mid-append leaves at most one torn line at the end
+                        print(f"⚠️ Skipping unreadable journal line: {line[:80]!r}")
+        except FileNotFoundError:
+            pass
+        return events
+    
+    def add(self, event):
+        with self.lock:
+            self.buffer.append(json.dumps(event, ensure_ascii=False) + "\n")
+        storage_writer.submit(self.write_buffered, key='journal')
+    
+    def write_buffered(self):
+        # Storage thread. A failed write is cut back to where it started before the lines go back
+        # to the buffer, so the retry cannot leave duplicates for replay to count twice.
+        with self.lock:
+            lines, self.buffer = self.buffer, []
+        if not lines:
+            return
+        offset = None
+        try:
+            if self.file is None:
+                self.file = open(self.path, 'ab')
+            offset = self.file.seek(0, os.SEEK_END)
+            self.file.write(''.join(lines).encode('utf-8'))
+            self.file.flush()
+        except Exception:
+            if self._rewind(offset):
+                with self.lock:
+                    self.buffer[:0] = lines
+            else:
+                print(f"⚠️ Dropping {len(lines)} journal lines: could not undo a partial write")
+            raise
+        self.appended += len(lines)
+    
+    def _rewind(self, offset):
+        """Close the journal and truncate it back to offset; True when nothing of the failed write remains"""
+        file, self.file = self.file, None
+        if file is not None:
+            try:
+                file.close()
+            except Exception:
+                pass
+        if offset is None:
+            # Failed before anything was written
+            return True
+        try:
+            os.truncate(self.path, offset)
+            return True
+        except OSError as e:
+            print(f"❌ Journal truncate failed: {e}")
+            return False
     
-    # Count today's success per user (use today_success_counts)
-    today_success_by_user = tracking.get("today_success_counts", {}).copy()
+    def compact(self):
+        """Storage thread: drop events the database already covers, archiving them per day"""
+        self.write_buffered()
+        upto = int(self.storage.get_meta('journal_seq', '0'))
+        events = self.read()
+        done = [event for event in events if event.get('seq', 0) <= upto]
+        if not done:
+            return
+        if self.archive:
+            os.makedirs(self.archive_dir, exist_ok=True)
+            by_day = {}
+            for event in done:
+                by_day.setdefault(str(event.get('ts', ''))[:10] or 'unknown', []).append(event)
+            for day, day_events in by_day.items():
+                with open(os.path.join(self.archive_dir, f"events-{day}.jsonl"), 'a', encoding='utf-8') as f:
+                    f.writelines(json.dumps(event, ensure_ascii=False) + "\n" for event in day_events)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.writelines(json.dumps(event, ensure_ascii=False) + "\n" for event in events if event.get('seq', 0) > upto)
+            f.flush()
+            os.fsync(f.fileno())
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        os.replace(tmp_path, self.path)
+        self.compactions += 1
+        self.last_compaction = datetime.now()
+        print(f"🗜️ Journal compacted: {len(done)} events folded, {len(events) - len(done)} kept")
+
+journal = EventJournal(storage, JOURNAL_FILE, JOURNAL_ARCHIVE_DIR, JOURNAL_ARCHIVE)
+
+# Write-back cache - stats reads come from memory, changes reach the database in debounced batches
+class CounterCache:
+    def __init__(self, storage, journal, delay):
+        self.storage = storage
+        self.journal = journal
+        self.delay = delay
+        self.values = {}  # (name, user_id) -> value, user_id '' for global counters
+        self.success_today = {}  # phone -> user_id since the last reset
+        self.otp_users = {}  # user_id -> (username, full_name)
+        self.daily_stats = {}  # day -> {user_id: successes}
+        self.last_reset = None
+        self.pending = {}  # (name, user_id) -> delta not yet written
+        self.pending_events = []
+        self.pending_users = {}
+        self.seq = 0  # last journal event applied in memory
+        self.pending_seq = 0  # last journal event covered by the pending batch
+        self.pending_first = None  # first journal event in the pending batch
+        self.carried = set()  # failed batches (by first seq) merged back into pending
+        self.loop = None
+        self._timer = None
+        self.flushes = 0
+        self.requeued = 0
+        self.replayed = 0
+        self.load()
+        self.replay()
+    
+    def load(self):
+        snapshot = self.storage.load_counters()
+        self.values = snapshot['values']
+        self.success_today = snapshot['success_today']
+        self.otp_users = snapshot['otp_users']
+        self.daily_stats = {}
+        for day, user_id, success in snapshot['daily_stats']:
+            self.daily_stats.setdefault(day, {})[user_id] = success
+        self.last_reset = snapshot['last_reset']
+    
+    def get(self, name, user_id=''):
+        return self.values.get((name, user_id), 0)
+    
+    def by_user(self, name):
+        return {user_id: value for (key, user_id), value in self.values.items() if key == name and user_id and value}
+    
+    def bump(self, *changes):
+        for name, user_id, delta in changes:
+            if not delta:
+                continue
+            key = (name, user_id)
+            self.values[key] = self.values.get(key, 0) + delta
+            self.pending[key] = self.pending.get(key, 0) + delta
+        self._schedule()
+    
+    def record(self, kind, user_id='', phone=None, count=1, **extra):
+        """Journal an event and apply it; False when there is nothing to count
+        (a success already counted since the last reset, or zero deletions)"""
+        if kind == 'success' and phone in self.success_today:
+            return False
+        if not count:
+            return False
+        self.seq += 1
+        event = {'seq': self.seq, 'type': kind, 'user_id': user_id, 'phone': phone, 'count': count,
+                 'ts': datetime.now().isoformat(), **extra}
+        self.journal.add(event)
+        self._apply(event)
+        return True
     
-    # Save today's success stats
-    tracking["daily_stats"][today_date] = today_success_by_user
+    def replay(self):
+        """Apply journaled events newer than the database snapshot - those a crash kept from being flushed"""
+        self.seq = int(self.storage.get_meta('journal_seq', '0'))
+        self.pending_seq = self.seq
+        for event in self.journal.read():
+            if event.get('seq', 0) > self.seq:
+                self.seq = event['seq']
+                self._apply(event)
+                self.replayed += 1
+        if self.replayed:
+            print(f"♻️ Replayed {self.replayed} journal events")
+            self.compact()
+    
+    def _apply(self, event):
+        kind = event['type']
+        user_id = event.get('user_id') or ''
+        count = event.get('count', 1)
+        if kind == 'reset':
+            self._rollover(event['day'], event['ts'], event['seq'])
+            return
+        self.pending_seq = event['seq']
+        if self.pending_first is None:
+            self.pending_first = event['seq']
+        if kind == 'checked':
+            self.bump(('checked_total', '', count), ('checked_today', '', count))
+        elif kind == 'added':
+            self.bump(('added_today', user_id, 1), ('checked_total', '', 1), ('checked_today', '', 1))
+        elif kind == 'deleted':
+            self.bump(('deleted_total', '', count), ('deleted_today', '', count))
+        elif kind == 'success':
+            phone = event['phone']
+            self.success_today[phone] = user_id
+            self.pending_events.append((phone, user_id, event['ts']))
+            if user_id not in self.otp_users:
+                self.otp_users[user_id] = (event.get('username'), "")
+                self.pending_users[user_id] = (event.get('username'), "")
+            self.bump(
+                ('otp_total', '', 1), ('otp_today', '', 1),
+                ('otp_total', user_id, 1), ('otp_today', user_id, 1),
+                ('success_count_today', user_id, 1),
+            )
     
-    # Reset today's tracking
-    tracking["today_added"] = {}
-    tracking["yesterday_success"] = tracking.get("today_success_counts", {}).copy()
-    tracking["today_success"] = {}
-    tracking["today_success_counts"] = {}
-    tracking["last_reset"] = datetime.now().isoformat()
+    def dirty(self):
+        return bool(self.pending or self.pending_events or self.pending_users)
     
-    # Also reset global stats
-    stats["yesterday_checked"] = stats["today_checked"]
-    stats["today_checked"] = 0
-    stats["yesterday_deleted"] = stats["today_deleted"]
-    stats["today_deleted"] = 0
+    def _schedule(self):
+        if self._timer is not None:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.flush()
+            return
+        self._timer = loop.call_later(self.delay, self._on_timer)
+    
+    def _on_timer(self):
+        self._timer = None
+        self.flush()
+    
+    def flush(self):
+        """Hand everything pending to the storage writer as one batch"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self.dirty():
+            return
+        changes, events, users = self.pending, self.pending_events, self.pending_users
+        seq, carried = self.pending_seq, self.carried
+        first = self.pending_first if self.pending_first is not None else seq
+        self.pending, self.pending_events, self.pending_users = {}, [], {}
+        self.pending_first, self.carried = None, set()
+        try:
+            self.loop = asyncio.get_running_loop()
+        except RuntimeError:
+            pass
+        storage_writer.submit(
+            self.storage.apply, changes, events, users, seq, carried,
+            on_failure=lambda: self._batch_failed(changes, events, users, seq, carried | {first})
+        )
+        self.flushes += 1
+    
+    def _batch_failed(self, changes, events, users, seq, carried):
+        # Storage thread: hold journal_seq below the batch, then hand it back to the loop for another flush
+        self.storage.unsaved.update(carried)
+        loop = self.loop
+        if loop is not None and not loop.is_closed():
+            loop.call_soon_threadsafe(self._requeue, changes, events, users, seq, carried)
+        else:
+            self._requeue(changes, events, users, seq, carried)
+    
+    def _requeue(self, changes, events, users, seq, carried):
+        for key, delta in changes.items():
+            self.pending[key] = self.pending.get(key, 0) + delta
+        self.pending_events[:0] = events
+        for user_id, info in users.items():
+            self.pending_users.setdefault(user_id, info)
+        self.carried |= carried
+        self.pending_seq = max(self.pending_seq, seq)
+        first = min(carried)
+        self.pending_first = first if self.pending_first is None else min(self.pending_first, first)
+        self.requeued += 1
+        print(f"♻️ Counter batch up to #{seq} failed to save, queued again")
+        self._schedule()
+    
+    def compact(self):
+        """Flush, then let the storage thread trim the journal down to what the database lacks"""
+        self.flush()
+        storage_writer.submit(self.journal.compact, key='journal-compact')
+    
+    async def run_compactor(self, interval):
+        while True:
+            await asyncio.sleep(interval)
+            self.compact()
+    
+    def rollover(self, day):
+        self.record('reset', day=day)
+    
+    def _rollover(self, day, at, seq):
+        """Daily reset in memory; the same reset is queued behind the pending counter batch"""
+        self.flush()
+        storage_writer.submit(self.storage.rollover, day, at, seq)
+        self.daily_stats[day] = self.by_user('success_count_today')
+        yesterday_names = set(Storage.ROLLOVER.values())
+        values = {}
+        for (name, user_id), value in self.values.items():
+            if name in Storage.ROLLOVER:
+                values[(Storage.ROLLOVER[name], user_id)] = value
+            elif name not in yesterday_names:
+                values[(name, user_id)] = value
+        self.values = values
+        self.success_today = {}
+        self.last_reset = at
+    
+    # Dict views in the shape of the old JSON files
+    def stats_view(self):
+        return {
+            "total_checked": self.get('checked_total'),
+            "total_deleted": self.get('deleted_total'),
+            "today_checked": self.get('checked_today'),
+            "today_deleted": self.get('deleted_today'),
+            "yesterday_checked": self.get('checked_yesterday'),
+            "yesterday_deleted": self.get('deleted_yesterday'),
+            "last_reset": self.last_reset
+        }
     
-    # Reset OTP stats
-    otp_stats["yesterday_success"] = otp_stats["today_success"]
-    otp_stats["today_success"] = 0
+    def otp_stats_view(self):
+        user_stats = {}
+        for user_id_str, (username, full_name) in self.otp_users.items():
+            user_stats[user_id_str] = {
+                "total_success": self.get('otp_total', user_id_str),
+                "today_success": self.get('otp_today', user_id_str),
+                "yesterday_success": self.get('otp_yesterday', user_id_str),
+                "username": username,
+                "full_name": full_name or ""
+            }
+        return {
+            "total_success": self.get('otp_total'),
+            "today_success": self.get('otp_today'),
+            "yesterday_success": self.get('otp_yesterday'),
+            "user_stats": user_stats,
+            "last_reset": self.last_reset
+        }
     
-    # Reset user-specific today success
-    for user_id_str in otp_stats.get("user_stats", {}):
-        otp_stats["user_stats"][user_id_str]["yesterday_success"] = otp_stats["user_stats"][user_id_str].get("today_success", 0)
-        otp_stats["user_stats"][user_id_str]["today_success"] = 0
+    def tracking_view(self):
+        return {
+            "added_numbers": {},
+            "success_numbers": {},
+            "today_added": self.by_user('added_today'),
+            "yesterday_added": self.by_user('added_yesterday'),
+            "today_success": dict(self.success_today),
+            "yesterday_success": self.by_user('success_count_yesterday'),
+            "today_success_counts": self.by_user('success_count_today'),
+            "daily_stats": {day: dict(counts) for day, counts in self.daily_stats.items()},
+            "last_reset": self.last_reset
+        }
+
+counter_cache = CounterCache(storage, journal, COUNTER_FLUSH_DELAY)
+
+async def reset_daily_stats(context: CallbackContext):
+    # Get today's date
+    today_date = datetime.now().date().isoformat()
     
-    save_stats(stats)
-    save_otp_stats(otp_stats)
-    save_tracking(tracking)
+    # Today's success counts go to daily_stats, today's counters become yesterday's
+    counter_cache.rollover(today_date)
     print(f"✅ Daily tracking reset (BD Time 4PM) - Date: {today_date}")
 
 
-# Enhanced file operations with error handling
+# Storage wrappers - the rest of the bot keeps using the old load/save names
+def load_tracking():
+    return counter_cache.tracking_view()
+
 def load_accounts():
     try:
-        # Try multiple possible file locations
-        possible_paths = [
-            ACCOUNTS_FILE,
-            "accounts.json",
-            "/tmp/accounts.json",
-            "./accounts.json"
-        ]
-        
-        for file_path in possible_paths:
-            try:
-                if os.path.exists(file_path):
-                    with open(file_path, 'r', encoding='utf-8') as f:
-                        data = json.load(f)
-                        print(f"✅ Loaded accounts from {file_path}")
-                        return data
-            except Exception as e:
-                print(f"❌ Error loading from {file_path}: {e}")
-                continue
-        
-        print("ℹ️ No accounts file found, starting fresh")
-        # Create initial structure with admin
-        initial_data = {
-            str(ADMIN_ID): []
-        }
-        save_accounts(initial_data)
-        return initial_data
-        
-    except Exception as e:
+        accounts = storage.load_accounts()
+    except sqlite3.Error as e:
         print(f"❌ Critical error loading accounts: {e}")
-        # Create initial structure
-        initial_data = {
-            str(ADMIN_ID): []
-        }
-        return initial_data
+        accounts = {}
+    if not accounts:
+        print("ℹ️ No accounts stored, starting fresh")
+        accounts[str(ADMIN_ID)] = []
+    return accounts
+
+def _write_accounts(accounts):
+    written = storage.save_accounts(accounts)
+    print(f"✅ Saved accounts ({written} rows changed)")
 
 def save_accounts(accounts):
-    try:
-        # Try multiple possible file locations
-        possible_paths = [
-            ACCOUNTS_FILE,
-            "accounts.json", 
-            "/tmp/accounts.json"
-        ]
-        
-        success = False
-        for file_path in possible_paths:
-            try:
-                with open(file_path, 'w', encoding='utf-8') as f:
-                    json.dump(accounts, f, indent=4, ensure_ascii=False)
-                print(f"✅ Saved accounts to {file_path}")
-                success = True
-                break
-            except Exception as e:
-                print(f"❌ Error saving to {file_path}: {e}")
-                continue
-        
-        if not success:
-            print("❌ Failed to save accounts to any location")
-            
-    except Exception as e:
-        print(f"❌ Critical error saving accounts: {e}")
+    # Snapshot now, write on the storage thread; back-to-back saves collapse into the latest
+    snapshot = {user_id_str: [dict(acc) for acc in user_accounts] for user_id_str, user_accounts in accounts.items()}
+    storage_writer.submit(_write_accounts, snapshot, key='accounts')
 
 def load_stats():
-    try:
-        possible_paths = [STATS_FILE, "stats.json", "/tmp/stats.json", "./stats.json"]
-        for file_path in possible_paths:
-            try:
-                if os.path.exists(file_path):
-                    with open(file_path, 'r', encoding='utf-8') as f:
-                        data = json.load(f)
-                        # Ensure we return a dictionary
-                        if isinstance(data, dict):
-                            return data
-                        else:
-                            print(f"⚠️ Stats file contains {type(data)}, returning default")
-                            return {
-                                "total_checked": 0, 
-                                "total_deleted": 0, 
-                                "today_checked": 0, 
-                                "today_deleted": 0,
-                                "yesterday_checked": 0,
-                                "yesterday_deleted": 0,
-                                "last_reset": datetime.now().isoformat()
-                            }
-            except:
-                continue
-        return {
-            "total_checked": 0, 
-            "total_deleted": 0, 
-            "today_checked": 0, 
-            "today_deleted": 0,
-            "yesterday_checked": 0,
-            "yesterday_deleted": 0,
-            "last_reset": datetime.now().isoformat()
-        }
-    except Exception as e:
-        print(f"❌ Error loading stats: {e}")
-        return {
-            "total_checked": 0, 
-            "total_deleted": 0, 
-            "today_checked": 0, 
-            "today_deleted": 0,
-            "yesterday_checked": 0,
-            "yesterday_deleted": 0,
-            "last_reset": datetime.now().isoformat()
-        }
+    return counter_cache.stats_view()
 
-def save_stats(stats):
-    try:
-        possible_paths = [STATS_FILE, "stats.json", "/tmp/stats.json"]
-        for file_path in possible_paths:
-            try:
-                with open(file_path, 'w', encoding='utf-8') as f:
-                    json.dump(stats, f, indent=4, ensure_ascii=False)
-                break
-            except:
-                continue
-    except Exception as e:
-        print(f"❌ Error saving stats: {e}")
-
-# OTP Stats file operations
 def load_otp_stats():
-    try:
-        possible_paths = [OTP_STATS_FILE, "otp_stats.json", "/tmp/otp_stats.json", "./otp_stats.json"]
-        for file_path in possible_paths:
-            try:
-                if os.path.exists(file_path):
-                    with open(file_path, 'r', encoding='utf-8') as f:
-                        data = json.load(f)
-                        print(f"✅ Loaded OTP stats from {file_path}")
-                        return data
-            except Exception as e:
-                print(f"❌ Error loading from {file_path}: {e}")
-                continue
-        return {
-            "total_success": 0,
-            "today_success": 0,
-            "yesterday_success": 0,
-            "user_stats": {},
-            "last_reset": datetime.now().isoformat()
-        }
-    except Exception as e:
-        print(f"❌ Error loading OTP stats: {e}")
-        return {
-            "total_success": 0,
-            "today_success": 0,
-            "yesterday_success": 0,
-            "user_stats": {},
-            "last_reset": datetime.now().isoformat()
-        }
+    return counter_cache.otp_stats_view()
 
-def save_otp_stats(otp_stats):
-    try:
-        possible_paths = [OTP_STATS_FILE, "otp_stats.json", "/tmp/otp_stats.json"]
-        for file_path in possible_paths:
-            try:
-                with open(file_path, 'w', encoding='utf-8') as f:
-                    json.dump(otp_stats, f, indent=4, ensure_ascii=False)
-                break
-            except:
-                continue
-    except Exception as e:
-        print(f"❌ Error saving OTP stats: {e}")
+def record_event(kind, user_id='', phone=None, count=1, **extra):
+    """Count a checked/added/success/deleted event; for success, True only the first time today"""
+    return counter_cache.record(kind, str(user_id) if user_id else '', phone, count, **extra)
+
+# Settings operations (for settlement rate); read from the database once, then served from memory
+settings_cache = dict(storage.load_settings())
 
-# Settings file operations (for settlement rate)
 def load_settings():
     try:
-        possible_paths = [SETTINGS_FILE, "settings.json", "/tmp/settings.json", "./settings.json"]
-        for file_path in possible_paths:
-            try:
-                if os.path.exists(file_path):
-                    with open(file_path, 'r', encoding='utf-8') as f:
-                        data = json.load(f)
-                        print(f"✅ Loaded settings from {file_path}")
-                        return data
-            except Exception as e:
-                print(f"❌ Error loading from {file_path}: {e}")
-                continue
+        if settings_cache:
+            return json.loads(json.dumps(settings_cache))
         # Default settings
         default_settings = {
             "settlement_rate": 0.10,  # Default rate $0.10
@@ -437,73 +1084,41 @@ def load_settings():
 
 def save_settings(settings):
     try:
-        possible_paths = [SETTINGS_FILE, "settings.json", "/tmp/settings.json"]
-        for file_path in possible_paths:
-            try:
-                with open(file_path, 'w', encoding='utf-8') as f:
-                    json.dump(settings, f, indent=4, ensure_ascii=False)
-                break
-            except:
-                continue
+        settings_cache.clear()
+        settings_cache.update(json.loads(json.dumps(settings)))
+        storage_writer.submit(storage.save_settings, dict(settings_cache), key='settings')
     except Exception as e:
         print(f"❌ Error saving settings: {e}")
 
 # Active OTP requests (in-memory only)
 active_otp_requests = {}
 
-# Async login - UPDATED VERSION
-async def login_api_async(username, password):
-    try:
-        async with aiohttp.ClientSession() as session:
-            payload = {"account": username, "password": password, "identity": "Member"}
-            
-            print(f"🔄 Attempting login for: {username}")
-            
-            async with session.post(f"{BASE_URL}/user/login", json=payload, timeout=30) as response:
-                response_text = await response.text()
-                print(f"📥 Response status: {response.status}")
-                
-                if response.status == 200:
-                    try:
-                        data = await response.json(content_type=None)
-                        
-                        if data and isinstance(data, dict):
-                            if "data" in data and "token" in data["data"]:
-                                token = data["data"]["token"]
-                                
-                                # Try to decode token to get user ID
-                                try:
-                                    decoded = jwt.decode(token, options={"verify_signature": False})
-                                    api_user_id = decoded.get('id')
-                                    nickname = decoded.get('nickname')
-                                    
-                                    print(f"✅ Login successful for {username}")
-                                    print(f"📝 API User ID: {api_user_id}")
-                                    print(f"👤 Nickname: {nickname}")
-                                    
-                                    return token, api_user_id, nickname
-                                except Exception as jwt_error:
-                                    print(f"⚠️ Could not decode token: {jwt_error}")
-                                    return token, None, None
-                            else:
-                                print(f"❌ Token not found in response for {username}")
-                                return None, None, None
-                        else:
-                            print(f"❌ Invalid response format for {username}")
-                            return None, None, None
-                    except json.JSONDecodeError as e:
-                        print(f"❌ JSON decode error for {username}: {e}")
-                        print(f"❌ Raw response: {response_text[:200]}...")
-                        return None, None, None
-                else:
-                    print(f"❌ Login failed: {username} - Status: {response.status}")
-                    return None, None, None
-    except asyncio.TimeoutError:
-        print(f"❌ Login timeout for {username}")
-        return None, None, None
-    except Exception as e:
-        print(f"❌ Login error for {username}: {type(e).__name__}: {e}")
-        return None, None, None
+# Adaptive polling interval for tracked numbers
+class PollBackoff:
+    def __init__(self, policy, default, factor, jitter, fast_interval, fast_window, deadline):
+        self.policy = policy
+        self.default = default
+        self.factor = factor
+        self.jitter = jitter
+        self.fast_interval = fast_interval
+        self.fast_window = fast_window
+        self.deadline = deadline
+    
+    def next_delay(self, status_code, unchanged, fast=False):
+        """Seconds until the next check; decays while status_code stays the same"""
+        if fast:
+            return self.fast_interval
+        base, cap = self.policy.get(status_code, self.default)
+        # Capped exponent: a long unchanged run must not overflow the float
+        delay = min(cap, base * (self.factor ** min(unchanged, 64)))
+        delay += delay * random.uniform(-self.jitter, self.jitter)
+        return max(self.fast_interval, delay)
+
+poll_backoff = PollBackoff(
+    TRACK_BACKOFF_POLICY, TRACK_BACKOFF_DEFAULT, TRACK_BACKOFF_FACTOR, TRACK_BACKOFF_JITTER,
+    TRACK_FAST_INTERVAL, TRACK_FAST_WINDOW, TRACK_DEADLINE_SECONDS
+)
+
 
 # Improved phone number extraction - ALL FORMATS
 def extract_phone_numbers(text: str) -> List[str]:
@@ -591,61 +1206,707 @@ def extract_phone_numbers(text: str) -> List[str]:
     
     return unique_numbers
     
-async def add_number_async(session, token, cc, phone, retry_count=2):
-    for attempt in range(retry_count):
+def parse_panel_json(text):
+    """Parse a panel response body, tolerating a BOM and surrounding whitespace"""
+    cleaned = text.strip()
+    if cleaned.startswith('\ufeff'):
+        cleaned = cleaned[1:]
+    if not cleaned:
+        return None
+    return json.loads(cleaned)
+
+def parse_status_record(record):
+    """Turn a getAullNum record into (status_code, status_name, record_id)"""
+    status_code = record.get("registrationStatus")
+    status_name = status_map.get(status_code, f"🔸 Status {status_code}")
+    return status_code, status_name, record.get("id")
+
+# Panel request limiter - token buckets plus AIMD adaptive concurrency
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+    
+    def take(self):
+        """Take one token; returns 0 on success or the seconds to wait before retrying"""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+    
+    def charge(self):
+        """Spend one token unconditionally; the bucket may go negative"""
+        if self.take():
+            self.tokens -= 1
+
+class FairQueue:
+    """Deficit round robin over per-user FIFO queues; each request costs 1, weight is the quantum"""
+    def __init__(self, default_weight):
+        self.default_weight = default_weight
+        self.weights = {}  # user key -> weight
+        self.queues = {}  # user key -> deque of waiters
+        self.deficit = {}
+        self.active = deque()  # keys with waiters, in round-robin order
+        self._len = 0
+    
+    def __len__(self):
+        return self._len
+    
+    def weight(self, key):
+        return self.weights.get(key, self.default_weight)
+    
+    def push(self, key, item):
+        queue = self.queues.get(key)
+        if queue is None:
+            queue = self.queues[key] = deque()
+            self.deficit[key] = 0.0
+            self.active.append(key)
+        queue.append(item)
+        self._len += 1
+    
+    def pop(self):
+        while self.active:
+            key = self.active[0]
+            if self.deficit[key] < 1:
+                # Key used up its share this round: top it up and move to the next one
+                self.deficit[key] += self.weight(key)
+                self.active.rotate(-1)
+                continue
+            self.deficit[key] -= 1
+            queue = self.queues[key]
+            item = queue.popleft()
+            self._len -= 1
+            if not queue:
+                del self.queues[key]
+                del self.deficit[key]
+                self.active.popleft()
+            return item
+        return None
+    
+    def waiting_by_key(self):
+        return {key: len(queue) for key, queue in self.queues.items()}
+
+class LatencyHistogram:
+    """Fixed-bucket latency histogram (seconds) with approximate percentiles"""
+    BOUNDS = (0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 30)
+    
+    def __init__(self):
+        self.counts = [0] * (len(self.BOUNDS) + 1)
+        self.total = 0.0
+        self.samples = 0
+        self.max = 0.0
+    
+    def observe(self, seconds):
+        index = 0
+        while index < len(self.BOUNDS) and seconds > self.BOUNDS[index]:
+            index += 1
+        self.counts[index] += 1
+        self.total += seconds
+        self.samples += 1
+        self.max = max(self.max, seconds)
+    
+    def percentile(self, p):
+        """Upper bound of the bucket holding the p-th percentile"""
+        if not self.samples:
+            return 0.0
+        rank = p / 100 * self.samples
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return self.BOUNDS[index] if index < len(self.BOUNDS) else self.max
+        return self.max
+    
+    def summary(self):
+        avg = self.total / self.samples if self.samples else 0.0
+        return (f"n={self.samples} avg {avg:.2f}s p50≤{self.percentile(50):.2f}s "
+                f"p95≤{self.percentile(95):.2f}s p99≤{self.percentile(99):.2f}s max {self.max:.2f}s")
+
+class PanelLimiter:
+    def __init__(self, rate, burst, account_rate, account_burst,
+                 initial_limit, min_limit, max_limit, latency_target):
+        self.global_bucket = TokenBucket(rate, burst)
+        self.account_rate = account_rate
+        self.account_burst = account_burst
+        self.account_buckets = {}  # token -> TokenBucket
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.latency_target = latency_target
+        self.inflight = 0
+        self._waiters = FairQueue(FAIR_DEFAULT_WEIGHT)
+        self._timer = None
+        self._loop = None
+        self.priority_slots = PANEL_PRIORITY_SLOTS
+        self.priority_inflight = 0
+        self._priority_waiters = deque()
+        self._last_decrease = 0.0
+        # Wait-time accounting
+        self.requests = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.recent_waits = deque(maxlen=500)
+        self.decreases = 0
+    
+    async def acquire(self, account=None, user=None):
+        """Wait for rate budget and a concurrency slot, queued fairly per user; returns seconds spent waiting"""
+        started = time.monotonic()
+        self._bind()
+        
+        if account:
+            bucket = self.account_buckets.get(account)
+            if bucket is None:
+                if len(self.account_buckets) > 5000:
+                    self._prune_buckets()
+                bucket = self.account_buckets[account] = TokenBucket(self.account_rate, self.account_burst)
+            while True:
+                wait = bucket.take()
+                if not wait:
+                    break
+                await asyncio.sleep(wait)
+        
+        # Global budget and concurrency are handed out by _wake in fair order;
+        # only an uncontended request goes straight through
+        if self._waiters or self.inflight >= int(self.limit) or self.global_bucket.take():
+            future = asyncio.get_running_loop().create_future()
+            self._waiters.push(user, future)
+            self._wake()
+            try:
+                await future
+            except asyncio.CancelledError:
+                if future.done() and not future.cancelled():
+                    # Slot was handed over just before cancellation
+                    self.inflight -= 1
+                    self._wake()
+                raise
+        else:
+            self.inflight += 1
+        
+        waited = time.monotonic() - started
+        self.requests += 1
+        self.total_wait += waited
+        self.max_wait = max(self.max_wait, waited)
+        self.recent_waits.append(waited)
+        return waited
+    
+    async def acquire_priority(self):
+        """Take a reserved priority slot; skips the fair queue and rate waits (the budget is still charged)"""
+        started = time.monotonic()
+        self._bind()
+        if self.priority_inflight >= self.priority_slots:
+            future = asyncio.get_running_loop().create_future()
+            self._priority_waiters.append(future)
+            try:
+                await future
+            except asyncio.CancelledError:
+                if future.done() and not future.cancelled():
+                    self.priority_inflight -= 1
+                    self._wake_priority()
+                raise
+        else:
+            self.priority_inflight += 1
+        # Background traffic pays this request back through the shared bucket
+        self.global_bucket.charge()
+        return time.monotonic() - started
+    
+    def _bind(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # Bot restarted on a new event loop: requests queued or in flight there will never release
+            weights = self._waiters.weights
+            self._waiters = FairQueue(FAIR_DEFAULT_WEIGHT)
+            self._waiters.weights = weights
+            self._priority_waiters = deque()
+            self.inflight = 0
+            self.priority_inflight = 0
+            self._timer = None
+            self._loop = loop
+    
+    def _wake_priority(self):
+        while self._priority_waiters and self.priority_inflight < self.priority_slots:
+            future = self._priority_waiters.popleft()
+            if not future.done():
+                self.priority_inflight += 1
+                future.set_result(None)
+    
+    def release(self, latency, ok, priority=False):
+        """Return a slot and adapt the limit: additive increase, multiplicative decrease"""
+        if priority:
+            self.priority_inflight -= 1
+            self._wake_priority()
+        else:
+            self.inflight -= 1
+        now = time.monotonic()
+        if not ok or latency > self.latency_target:
+            # Cut at most once per target latency so one slow burst is not punished repeatedly
+            if now - self._last_decrease > self.latency_target:
+                self.limit = max(self.min_limit, self.limit * 0.7)
+                self._last_decrease = now
+                self.decreases += 1
+        else:
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+        self._wake()
+    
+    def _wake(self):
+        while self._waiters and self.inflight < int(self.limit):
+            wait = self.global_bucket.take()
+            if wait:
+                # Out of rate budget: come back when the next token is due
+                if self._timer is None:
+                    self._timer = asyncio.get_running_loop().call_later(wait, self._on_timer)
+                return
+            future = self._waiters.pop()
+            if future.done():
+                # Waiter gave up; return its rate token
+                self.global_bucket.tokens += 1
+                continue
+            self.inflight += 1
+            future.set_result(None)
+    
+    def _on_timer(self):
+        self._timer = None
+        self._wake()
+    
+    def set_weights(self, weights):
+        self._waiters.weights = {str(key): float(weight) for key, weight in weights.items()}
+    
+    def _prune_buckets(self):
+        now = time.monotonic()
+        for account, bucket in list(self.account_buckets.items()):
+            if now - bucket.updated > 600:
+                del self.account_buckets[account]
+    
+    def stats(self):
+        waits = sorted(self.recent_waits)
+        p95 = waits[int(len(waits) * 0.95) - 1] if waits else 0.0
+        return {
+            'limit': int(self.limit),
+            'inflight': self.inflight,
+            'waiting': len(self._waiters),
+            'requests': self.requests,
+            'avg_wait': self.total_wait / self.requests if self.requests else 0.0,
+            'p95_wait': p95,
+            'max_wait': self.max_wait,
+            'decreases': self.decreases
+        }
+
+panel_limiter = PanelLimiter(
+    PANEL_RATE, PANEL_BURST, PANEL_ACCOUNT_RATE, PANEL_ACCOUNT_BURST,
+    PANEL_CONCURRENCY, PANEL_CONCURRENCY_MIN, PANEL_CONCURRENCY_MAX, PANEL_LATENCY_TARGET
+)
+
+# Circuit breaker for the panel API - closed / open / half-open on a rolling error rate
+BREAKER_CLOSED = 'closed'
+BREAKER_OPEN = 'open'
+BREAKER_HALF_OPEN = 'half_open'
+
+class PanelUnavailable(Exception):
+    pass
+
+class CircuitBreaker:
+    def __init__(self, window, min_requests, error_rate, open_seconds, half_open_probes):
+        self.window = window
+        self.min_requests = min_requests
+        self.error_rate = error_rate
+        self.open_seconds = open_seconds
+        self.half_open_probes = half_open_probes
+        self.state = BREAKER_CLOSED
+        self.opened_at = 0.0
+        self.trips = 0
+        self._outcomes = deque()  # (timestamp, ok)
+        self._errors = 0
+        self._probes = 0
+    
+    def is_open(self):
+        """True while requests are being rejected and callers should pause"""
+        if self.state == BREAKER_HALF_OPEN:
+            # Probes are out; everyone else waits for their verdict
+            return self._probes >= self.half_open_probes
+        return self.state == BREAKER_OPEN and time.monotonic() < self.opened_at + self.open_seconds
+    
+    def retry_in(self):
+        return max(1.0, self.opened_at + self.open_seconds - time.monotonic())
+    
+    def allow(self):
+        """Admit one request or raise PanelUnavailable"""
+        if self.state == BREAKER_OPEN:
+            if self.is_open():
+                raise PanelUnavailable(f"Panel unavailable, retrying in {self.retry_in():.0f}s")
+            self.state = BREAKER_HALF_OPEN
+            self._probes = 0
+            print("🟡 Panel circuit half-open, probing")
+        if self.state == BREAKER_HALF_OPEN:
+            if self._probes >= self.half_open_probes:
+                raise PanelUnavailable("Panel recovering, please wait")
+            self._probes += 1
+    
+    def cancel(self):
+        """Forget an admitted request that never produced an outcome"""
+        if self.state == BREAKER_HALF_OPEN:
+            self._probes = max(0, self._probes - 1)
+    
+    def record(self, ok):
+        now = time.monotonic()
+        if self.state == BREAKER_HALF_OPEN:
+            self._probes = max(0, self._probes - 1)
+            if ok:
+                self._close()
+            else:
+                self._open(now)
+            return
+        
+        self._outcomes.append((now, ok))
+        if not ok:
+            self._errors += 1
+        while self._outcomes and self._outcomes[0][0] < now - self.window:
+            _, old_ok = self._outcomes.popleft()
+            if not old_ok:
+                self._errors -= 1
+        
+        total = len(self._outcomes)
+        if (self.state == BREAKER_CLOSED and total >= self.min_requests and
+                self._errors / total >= self.error_rate):
+            self._open(now)
+    
+    def _open(self, now):
+        self.state = BREAKER_OPEN
+        self.opened_at = now
+        self.trips += 1
+        print(f"🔴 Panel circuit OPEN for {self.open_seconds:.0f}s (trip #{self.trips})")
+    
+    def _close(self):
+        self.state = BREAKER_CLOSED
+        self._outcomes.clear()
+        self._errors = 0
+        print("🟢 Panel circuit closed, panel healthy again")
+    
+    def stats(self):
+        total = len(self._outcomes)
+        return {
+            'state': self.state,
+            'error_rate': self._errors / total if total else 0.0,
+            'samples': total,
+            'trips': self.trips,
+            'retry_in': self.retry_in() if self.is_open() else 0.0
+        }
+
+panel_breaker = CircuitBreaker(
+    BREAKER_WINDOW, BREAKER_MIN_REQUESTS, BREAKER_ERROR_RATE, BREAKER_OPEN_SECONDS, BREAKER_HALF_OPEN_PROBES
+)
+
+# Status text shown on tracked numbers while the breaker holds them
+PANEL_PAUSED_STATUS = "⏸️ Server Busy (Paused)"
+
+# Single-flight - identical concurrent panel requests share one in-flight call
+class SingleFlight:
+    def __init__(self):
+        self._inflight = {}  # key -> Future
+        self._cache = {}  # key -> (expires_at, result)
+        self.calls = 0
+        self.shared = 0
+    
+    async def do(self, key, factory, ttl=0.0):
+        """Return factory()'s result, joining an identical call already running for key"""
+        if ttl:
+            cached = self._cache.get(key)
+            if cached and cached[0] > time.monotonic():
+                self.shared += 1
+                return cached[1]
+        
+        future = self._inflight.get(key)
+        if future is not None and future.get_loop() is not asyncio.get_running_loop():
+            # Left on an event loop that died with a bot restart; it will never finish
+            future = None
+        if future is None:
+            self.calls += 1
+            future = asyncio.ensure_future(self._run(key, factory, ttl))
+            self._inflight[key] = future
+        else:
+            self.shared += 1
+        # Shield so one caller giving up does not cancel the call for the others
+        return await asyncio.shield(future)
+    
+    async def _run(self, key, factory, ttl):
         try:
-            headers = {"Admin-Token": token}
-            add_url = f"{BASE_URL}/z-number-base/addNum?cc={cc}&phoneNum={phone}&smsStatus=2"
-            async with session.post(add_url, headers=headers, timeout=10) as response:
-                if response.status == 200:
+            result = await factory()
+            if ttl:
+                if len(self._cache) > 2000:
+                    now = time.monotonic()
+                    self._cache = {k: v for k, v in self._cache.items() if v[0] > now}
+                self._cache[key] = (time.monotonic() + ttl, result)
+            return result
+        finally:
+            self._inflight.pop(key, None)
+    
+    def forget(self, key):
+        self._cache.pop(key, None)
+
+# Token validity cache - trust JWT exp and recent successful calls instead of probing
+class TokenValidityCache:
+    def __init__(self, expiry_skew, ok_ttl):
+        self.expiry_skew = expiry_skew
+        self.ok_ttl = ok_ttl
+        self._exp = {}  # token -> exp timestamp or None
+        self._last_ok = {}  # token -> time of last successful real call
+        self._invalid = set()
+        self.hits = 0
+        self.probes = 0
+    
+    def expiry(self, token):
+        """JWT exp claim of token (cached), or None if it has none"""
+        if token not in self._exp:
+            if len(self._exp) > 10000:
+                self._prune()
+            try:
+                exp = jwt.decode(token, options={"verify_signature": False}).get('exp')
+                self._exp[token] = float(exp) if exp else None
+            except Exception:
+                self._exp[token] = None
+        return self._exp[token]
+    
+    def check(self, token):
+        """True if token can be trusted, False if known bad, None if a probe is needed"""
+        if token in self._invalid:
+            return False
+        now = time.time()
+        exp = self.expiry(token)
+        if exp is not None and now >= exp:
+            return False
+        if exp is not None and now < exp - self.expiry_skew:
+            return True
+        last_ok = self._last_ok.get(token)
+        if last_ok and now - last_ok < self.ok_ttl:
+            return True
+        return None
+    
+    def mark_ok(self, token):
+        self._last_ok[token] = time.time()
+        self._invalid.discard(token)
+    
+    def mark_invalid(self, token):
+        self._invalid.add(token)
+        self._last_ok.pop(token, None)
+    
+    def _prune(self):
+        now = time.time()
+        for token, exp in list(self._exp.items()):
+            if exp is None or exp < now:
+                self._exp.pop(token, None)
+                self._last_ok.pop(token, None)
+                self._invalid.discard(token)
+
+token_cache = TokenValidityCache(TOKEN_EXPIRY_SKEW, TOKEN_OK_TTL)
+
+# Panel API client - one pooled session shared by every panel call
+class PanelClient:
+    def __init__(self, base_url):
+        self.base_url = base_url
+        self._sessions = {}  # lane -> session; the priority lane has its own connections
+        self._loop = None
+        self.single_flight = SingleFlight()
+        self.latency = {'priority': LatencyHistogram(), 'normal': LatencyHistogram()}
+
+    def _get_session(self, priority=False):
+        """Return the lane's shared session, creating it on the running loop if needed"""
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._sessions = {}
+            self._loop = loop
+        lane = 'priority' if priority else 'normal'
+        session = self._sessions.get(lane)
+        if session is None or session.closed:
+            limit = PANEL_PRIORITY_POOL if priority else PANEL_POOL_LIMIT
+            connector = aiohttp.TCPConnector(
+                limit=limit,
+                limit_per_host=limit if priority else PANEL_POOL_PER_HOST,
+                ttl_dns_cache=PANEL_DNS_TTL,
+                use_dns_cache=True,
+                keepalive_timeout=PANEL_KEEPALIVE
+            )
+            session = self._sessions[lane] = aiohttp.ClientSession(connector=connector)
+        return session
+
+    async def close(self):
+        for session in self._sessions.values():
+            if not session.closed:
+                await session.close()
+        self._sessions = {}
+        self._loop = None
+
+    async def _send(self, method, path, token=None, json_body=None, timeout=10, priority=False):
+        """Send one request over the pooled session, returns (status, text); priority uses the OTP lane"""
+        queued = time.monotonic()
+        session = self._get_session(priority)
+        headers = {"Admin-Token": token} if token else None
+        panel_breaker.allow()
+        try:
+            if priority:
+                await panel_limiter.acquire_priority()
+            else:
+                await panel_limiter.acquire(token, account_manager.owner_of(token) if token else None)
+        except BaseException:
+            panel_breaker.cancel()
+            raise
+        started = time.monotonic()
+        ok = False
+        cancelled = False
+        try:
+            async with session.request(
+                method,
+                f"{self.base_url}{path}",
+                headers=headers,
+                json=json_body,
+                timeout=aiohttp.ClientTimeout(total=timeout)
+            ) as response:
+                text = await response.text()
+                ok = response.status < 500
+                if token and response.status == 401:
+                    token_cache.mark_invalid(token)
+                # A 200 can still carry code 28004 (login expired); callers judge the token from the body
+                return response.status, text
+        except asyncio.CancelledError:
+            # Caller gave up, not a panel failure
+            cancelled = True
+            raise
+        finally:
+            finished = time.monotonic()
+            panel_limiter.release(finished - started, ok or cancelled, priority)
+            if not cancelled:
+                # Time from asking to answer, queueing included: what the lane is there to cut
+                self.latency['priority' if priority else 'normal'].observe(finished - queued)
+            if cancelled:
+                panel_breaker.cancel()
+            else:
+                panel_breaker.record(ok)
+
+    def _check_token(self, token, result):
+        """Update token_cache from a parsed body; returns False when it says the login expired"""
+        if not token or not isinstance(result, dict):
+            return True
+        if result.get('code') == 28004:
+            token_cache.mark_invalid(token)
+            return False
+        if result.get('code') == 200:
+            token_cache.mark_ok(token)
+        return True
+
+    async def login(self, username, password):
+        # Concurrent /start and Refresh Server presses share one login
+        return await self.single_flight.do(
+            ('login', username, password), lambda: self._login(username, password), LOGIN_SINGLEFLIGHT_TTL
+        )
+
+    async def _login(self, username, password):
+        try:
+            payload = {"account": username, "password": password, "identity": "Member"}
+            
+            print(f"🔄 Attempting login for: {username}")
+            
+            status, response_text = await self._send("POST", "/user/login", json_body=payload, timeout=30)
+            print(f"📥 Response status: {status}")
+            
+            if status == 200:
+                try:
+                    data = parse_panel_json(response_text)
+                    
+                    if data and isinstance(data, dict):
+                        if "data" in data and "token" in data["data"]:
+                            token = data["data"]["token"]
+                            
+                            # Try to decode token to get user ID
+                            try:
+                                decoded = jwt.decode(token, options={"verify_signature": False})
+                                api_user_id = decoded.get('id')
+                                nickname = decoded.get('nickname')
+                                
+                                print(f"✅ Login successful for {username}")
+                                print(f"📝 API User ID: {api_user_id}")
+                                print(f"👤 Nickname: {nickname}")
+                                
+                                return token, api_user_id, nickname
+                            except Exception as jwt_error:
+                                print(f"⚠️ Could not decode token: {jwt_error}")
+                                return token, None, None
+                        else:
+                            print(f"❌ Token not found in response for {username}")
+                            return None, None, None
+                    else:
+                        print(f"❌ Invalid response format for {username}")
+                        return None, None, None
+                except json.JSONDecodeError as e:
+                    print(f"❌ JSON decode error for {username}: {e}")
+                    print(f"❌ Raw response: {response_text[:200]}...")
+                    return None, None, None
+            else:
+                print(f"❌ Login failed: {username} - Status: {status}")
+                return None, None, None
+        except asyncio.TimeoutError:
+            print(f"❌ Login timeout for {username}")
+            return None, None, None
+        except Exception as e:
+            print(f"❌ Login error for {username}: {type(e).__name__}: {e}")
+            return None, None, None
+
+    async def add_number(self, token, cc, phone, retry_count=2):
+        for attempt in range(retry_count):
+            try:
+                status, response_text = await self._send("POST", f"/z-number-base/addNum?cc={cc}&phoneNum={phone}&smsStatus=2", token)
+                if status == 200:
+                    try:
+                        result = parse_panel_json(response_text)
+                    except ValueError:
+                        result = None
+                    if not self._check_token(token, result):
+                        print(f"❌ Login required during add for {phone}")
+                        return False
                     print(f"✅ Number {phone} added successfully")
                     return True
-                elif response.status == 401:
+                elif status == 401:
                     print(f"❌ Token expired during add for {phone}, attempt {attempt + 1}")
                     continue
-                elif response.status in (400, 409):
-                    print(f"❌ Number {phone} already exists or invalid, status {response.status}")
+                elif status in (400, 409):
+                    print(f"❌ Number {phone} already exists or invalid, status {status}")
                     return False
                 else:
-                    print(f"❌ Add failed for {phone} with status {response.status}")
-        except Exception as e:
-            print(f"❌ Add number error for {phone} (attempt {attempt + 1}): {e}")
-    return False
+                    print(f"❌ Add failed for {phone} with status {status}")
+            except Exception as e:
+                print(f"❌ Add number error for {phone} (attempt {attempt + 1}): {e}")
+        return False
 
-# Status checking - FIXED VERSION
-async def get_status_async(session, token, phone):
-    try:
-        headers = {"Admin-Token": token}
-        status_url = f"{BASE_URL}/z-number-base/getAullNum?page=1&pageSize=15&phoneNum={phone}"
-        
-        async with session.get(status_url, headers=headers, timeout=10) as response:
-            response_text = await response.text()
+    async def get_status(self, token, phone, priority=False):
+        # Tracker fallbacks, OTP checks and delete lookups for the same number share one request
+        return await self.single_flight.do(
+            ('status', token, phone, priority), lambda: self._get_status(token, phone, priority), STATUS_SINGLEFLIGHT_TTL
+        )
+
+    # Status checking - FIXED VERSION
+    async def _get_status(self, token, phone, priority=False):
+        try:
+            status, response_text = await self._send(
+                "GET", f"/z-number-base/getAullNum?page=1&pageSize=15&phoneNum={phone}", token, priority=priority
+            )
             
-            if response.status == 401:
+            if status == 401:
                 print(f"❌ Token expired for {phone}")
                 return -1, "❌ Token Expired", None
             
-            # Try to parse JSON with any content type
             try:
-                res = await response.json(content_type=None)
+                res = parse_panel_json(response_text)
             except Exception as json_error:
-                print(f"❌ JSON parse attempt 1 failed for {phone}: {json_error}")
-                # Try manual JSON parsing
-                try:
-                    # Clean the response text
-                    cleaned_text = response_text.strip()
-                    # Remove any BOM or extra characters
-                    if cleaned_text.startswith('\ufeff'):
-                        cleaned_text = cleaned_text[1:]
-                    
-                    # Try to parse as JSON
-                    res = json.loads(cleaned_text)
-                except Exception as e2:
-                    print(f"❌ Manual JSON parse also failed for {phone}: {e2}")
-                    print(f"❌ Raw response: {response_text[:500]}")
-                    return -2, "❌ API Error", None
-            
-            if res.get('code') == 28004:
+                print(f"❌ JSON parse failed for {phone}: {json_error}")
+                print(f"❌ Raw response: {response_text[:500]}")
+                return -2, "❌ API Error", None
+            
+            if not isinstance(res, dict):
+                print(f"❌ Unexpected status response for {phone}: {response_text[:200]}")
+                return -2, "❌ API Error", None
+            
+            if not self._check_token(token, res):
                 print(f"❌ Login required for {phone}")
                 return -1, "❌ Token Expired", None
             
@@ -657,48 +1918,77 @@ async def get_status_async(session, token, phone):
                 print(f"❌ Number {phone} already exists, code {res.get('code')}")
                 return 16, "🚫 Already Exists", None
             
-            if (res and "data" in res and "records" in res["data"] and 
+            if ("data" in res and res["data"] and "records" in res["data"] and 
                 res["data"]["records"] and len(res["data"]["records"]) > 0):
-                record = res["data"]["records"][0]
-                status_code = record.get("registrationStatus")
-                record_id = record.get("id")
-                status_name = status_map.get(status_code, f"🔸 Status {status_code}")
-                return status_code, status_name, record_id
-            
-            # If no records found but response is successful
-            if res and "data" in res and "records" in res["data"]:
-                return None, "🚫 Already Registered...", None
+                return parse_status_record(res["data"]["records"][0])
             
             return None, "🚫 Already Registered...", None
             
-    except Exception as e:
-        print(f"❌ Status error for {phone}: {type(e).__name__}: {e}")
-        return -2, "🔄 Refresh Server", None
+        except Exception as e:
+            print(f"❌ Status error for {phone}: {type(e).__name__}: {e}")
+            return -2, "🔄 Refresh Server", None
 
-# Async delete
-async def delete_single_number_async(session, token, record_id, username):
-    try:
-        headers = {"Admin-Token": token}
-        delete_url = f"{BASE_URL}/z-number-base/deleteNum/{record_id}"
-        async with session.delete(delete_url, headers=headers, timeout=10) as response:
-            if response.status == 200:
+    async def list_numbers(self, token, page=1, page_size=100):
+        """Fetch one page of an account's numbers, returns (error_code, error_name, records, pages)"""
+        try:
+            status, response_text = await self._send("GET", f"/z-number-base/getAullNum?page={page}&pageSize={page_size}", token)
+            
+            if status == 401:
+                print("❌ Token expired while listing numbers")
+                return -1, "❌ Token Expired", [], 0
+            
+            try:
+                res = parse_panel_json(response_text)
+            except Exception as json_error:
+                print(f"❌ JSON parse failed for number list: {json_error}")
+                return -2, "❌ API Error", [], 0
+            
+            if not isinstance(res, dict):
+                return -2, "❌ API Error", [], 0
+            
+            if not self._check_token(token, res):
+                print("❌ Login required while listing numbers")
+                return -1, "❌ Token Expired", [], 0
+            
+            data = res.get("data")
+            if not isinstance(data, dict) or not isinstance(data.get("records"), list):
+                # Unknown shape, callers fall back to per-phone lookups
+                return -3, "❌ No Data Found", [], 0
+            
+            return None, None, data["records"], data.get("pages", 1)
+            
+        except Exception as e:
+            print(f"❌ Number list error: {type(e).__name__}: {e}")
+            return -2, "🔄 Refresh Server", [], 0
+
+    async def delete_number(self, token, record_id, username):
+        try:
+            status, response_text = await self._send("DELETE", f"/z-number-base/deleteNum/{record_id}", token)
+            if status == 200:
+                try:
+                    result = parse_panel_json(response_text)
+                except ValueError:
+                    result = None
+                if not self._check_token(token, result):
+                    print(f"❌ Login required while deleting {record_id}")
+                    return False
                 return True
             else:
-                print(f"❌ Delete failed for {record_id}: Status {response.status}")
+                print(f"❌ Delete failed for {record_id}: Status {status}")
                 return False
-    except Exception as e:
-        print(f"❌ Delete error for {record_id}: {e}")
-        return False
+        except Exception as e:
+            print(f"❌ Delete error for {record_id}: {e}")
+            return False
 
-# OTP submission function
-async def submit_otp_async(session, token, phone, code):
-    try:
-        headers = {"Admin-Token": token}
-        otp_url = f"{BASE_URL}/z-number-base/allNum/uploadCode?phoneNum={phone}&code={code}"
-        async with session.get(otp_url, headers=headers, timeout=10) as response:
-            if response.status == 200:
+    async def submit_otp(self, token, phone, code):
+        try:
+            status, text_result = await self._send(
+                "GET", f"/z-number-base/allNum/uploadCode?phoneNum={phone}&code={code}", token, priority=True
+            )
+            if status == 200:
                 try:
-                    result = await response.json(content_type=None)
+                    result = parse_panel_json(text_result)
+                    self._check_token(token, result)
                     if result.get('code') == 200:
                         print(f"✅ OTP submitted successfully for {phone}")
                         return True, "OTP verified successfully"
@@ -706,8 +1996,7 @@ async def submit_otp_async(session, token, phone, code):
                         print(f"❌ OTP submission failed for {phone}: {result.get('msg', 'Unknown error')}")
                         return False, result.get('msg', 'Unknown error')
                 except:
-                    # Try to get text response
-                    text_result = await response.text()
+                    # Fall back to the raw text response
                     if "success" in text_result.lower() or "200" in text_result:
                         print(f"✅ OTP submitted successfully for {phone} (text response)")
                         return True, "OTP verified successfully"
@@ -715,28 +2004,25 @@ async def submit_otp_async(session, token, phone, code):
                         print(f"❌ OTP submission failed for {phone}: {text_result}")
                         return False, text_result
             else:
-                print(f"❌ OTP submission failed for {phone}: Status {response.status}")
-                return False, f"HTTP Error: {response.status}"
-    except Exception as e:
-        print(f"❌ OTP submission error for {phone}: {e}")
-        return False, str(e)
+                print(f"❌ OTP submission failed for {phone}: Status {status}")
+                return False, f"HTTP Error: {status}"
+        except Exception as e:
+            print(f"❌ OTP submission error for {phone}: {e}")
+            return False, str(e)
 
-# Settlement functions - FIXED VERSION
-async def get_user_settlements(session, token, user_id, page=1, page_size=2):
-    """Get settlement records for a specific user - CORRECTED VERSION"""
-    try:
-        headers = {"Admin-Token": token}
-        url = f"{BASE_URL}/m-settle-accounts/closingEntries?page={page}&pageSize={page_size}&userid={user_id}"
-        
-        print(f"🔍 Fetching settlements for user {user_id}")
-        
-        async with session.get(url, headers=headers, timeout=10) as response:
-            response_text = await response.text()
-            print(f"📥 Response status: {response.status}")
+    # Settlement functions - FIXED VERSION
+    async def get_user_settlements(self, token, user_id, page=1, page_size=2):
+        """Get settlement records for a specific user - CORRECTED VERSION"""
+        try:
+            print(f"🔍 Fetching settlements for user {user_id}")
+            
+            status, response_text = await self._send("GET", f"/m-settle-accounts/closingEntries?page={page}&pageSize={page_size}&userid={user_id}", token)
+            print(f"📥 Response status: {status}")
             
-            if response.status == 200:
+            if status == 200:
                 try:
-                    result = await response.json(content_type=None)
+                    result = parse_panel_json(response_text)
+                    self._check_token(token, result)
                     
                     if result.get('code') == 200:
                         data = result.get('data', {})
@@ -771,22 +2057,20 @@ async def get_user_settlements(session, token, user_id, page=1, page_size=2):
                     print(f"❌ JSON parse error in get_user_settlements: {e}")
                     return None, f"JSON parse error: {e}"
             else:
-                print(f"❌ HTTP Error in get_user_settlements: {response.status}")
-                return None, f"HTTP Error: {response.status}"
-    except Exception as e:
-        print(f"❌ Exception in get_user_settlements: {e}")
-        return None, str(e)
+                print(f"❌ HTTP Error in get_user_settlements: {status}")
+                return None, f"HTTP Error: {status}"
+        except Exception as e:
+            print(f"❌ Exception in get_user_settlements: {e}")
+            return None, str(e)
 
-async def get_all_billing_list(session, token, page=1, page_size=15):
-    """Get billing list for admin"""
-    try:
-        headers = {"Admin-Token": token}
-        url = f"{BASE_URL}/z-billinglist/getBillingList?page={page}&pageSize={page_size}"
-        
-        async with session.get(url, headers=headers, timeout=10) as response:
-            if response.status == 200:
+    async def get_billing_list(self, token, page=1, page_size=15):
+        """Get billing list for admin"""
+        try:
+            status, response_text = await self._send("GET", f"/z-billinglist/getBillingList?page={page}&pageSize={page_size}", token)
+            if status == 200:
                 try:
-                    result = await response.json(content_type=None)
+                    result = parse_panel_json(response_text)
+                    self._check_token(token, result)
                     if result.get('code') == 200:
                         return result.get('data', {}), None
                     else:
@@ -794,9 +2078,190 @@ async def get_all_billing_list(session, token, page=1, page_size=15):
                 except Exception as e:
                     return None, f"JSON parse error: {e}"
             else:
-                return None, f"HTTP Error: {response.status}"
-    except Exception as e:
-        return None, str(e)
+                return None, f"HTTP Error: {status}"
+        except Exception as e:
+            return None, str(e)
+
+# Global panel client
+panel_client = PanelClient(BASE_URL)
+
+# Batched status poller - one paged number list per account per tick
+class StatusPoller:
+    def __init__(self, client, interval=1.0, page_size=100, max_pages=5):
+        self.client = client
+        self.interval = interval
+        self.page_size = page_size
+        self.max_pages = max_pages
+        self._waiters = {}  # token -> {phone: [futures]}
+        self._inflight = set()  # tokens with a list fetch running
+        self._task = None
+        self._loop = None
+        self._last_tick = 0.0
+    
+    async def get_status(self, token, phone):
+        """Wait for the next tick and return (status_code, status_name, record_id) for phone"""
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # Bot restarted on a new event loop: waiters and fetches from the old one are gone
+            self._waiters, self._inflight, self._task = {}, set(), None
+            self._loop = loop
+        future = loop.create_future()
+        self._waiters.setdefault(token, {}).setdefault(phone, []).append(future)
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        return await future
+    
+    def pending_count(self):
+        return sum(len(phones) for phones in self._waiters.values())
+    
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while self._waiters:
+            delay = self._last_tick + self.interval - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self._last_tick = loop.time()
+            
+            # Accounts whose previous fetch is still running wait for the next tick
+            ready = [token for token in self._waiters if token not in self._inflight]
+            for token in ready:
+                phones = self._waiters.pop(token)
+                self._inflight.add(token)
+                spawn_background(self._poll_account(token, phones))
+            
+            if not ready:
+                await asyncio.sleep(self.interval)
+    
+    async def _poll_account(self, token, phones):
+        results = {}
+        try:
+            results = await self._fetch_account(token, set(phones))
+        except Exception as e:
+            print(f"❌ Batched status error: {type(e).__name__}: {e}")
+        finally:
+            self._inflight.discard(token)
+            for phone, futures in phones.items():
+                result = results.get(phone, (-2, "🔄 Refresh Server", None))
+                for future in futures:
+                    if not future.done():
+                        future.set_result(result)
+    
+    async def _fetch_account(self, token, wanted):
+        results = {}
+        complete = False
+        page = 1
+        while wanted and page <= self.max_pages:
+            error_code, error_name, records, pages = await self.client.list_numbers(token, page, self.page_size)
+            if error_code in (-1, -2):
+                return {phone: (error_code, error_name, None) for phone in wanted}
+            if error_code is not None or (records and not any("phoneNum" in r for r in records)):
+                break
+            
+            for record in records:
+                phone = str(record.get("phoneNum", ""))
+                if phone in wanted:
+                    results[phone] = parse_status_record(record)
+                    wanted.discard(phone)
+            
+            if page >= (pages or 1) or len(records) < self.page_size:
+                complete = True
+                break
+            page += 1
+        
+        if wanted:
+            if complete:
+                for phone in wanted:
+                    results[phone] = (None, "🚫 Already Registered...", None)
+            else:
+                # List was truncated or unreadable, ask for the rest one by one
+                phones = list(wanted)
+                lookups = await asyncio.gather(*(self.client.get_status(token, phone) for phone in phones))
+                results.update(zip(phones, lookups))
+        
+        return results
+
+status_poller = StatusPoller(panel_client, STATUS_POLL_INTERVAL, STATUS_POLL_PAGE_SIZE, STATUS_POLL_MAX_PAGES)
+
+# Account token state - one compact record per logged-in account
+TOKEN_OK = "ok"
+TOKEN_EXPIRED = "expired"
+TOKEN_FAILED = "failed"
+
+class TokenState:
+    __slots__ = ('handle', 'token', 'username', 'api_user_id', 'usage', 'exp', 'owner', 'health', 'failures', 'retry_at')
+    
+    def __init__(self, handle, token, username, api_user_id, owner):
+        self.handle = handle
+        self.username = username
+        self.owner = owner  # user_id string
+        self.usage = 0
+        self.set_token(token, api_user_id)
+    
+    def set_token(self, token, api_user_id):
+        self.token = token
+        self.api_user_id = api_user_id
+        self.exp = token_cache.expiry(token)
+        self.health = TOKEN_OK
+        self.failures = 0  # keeper logins failed in a row
+        self.retry_at = 0.0  # keeper leaves the account alone until then
+
+# Per-user slot accounting - token states bucketed by usage, so picking the
+# least-used account and counting free slots never scans the whole pool
+class CapacityIndex:
+    def __init__(self, limit):
+        self.limit = limit
+        self.buckets = [{} for _ in range(limit + 1)]  # usage -> {handle: state} (insertion ordered)
+        self.remaining = 0
+    
+    def __contains__(self, state):
+        return state.handle in self.buckets[state.usage]
+    
+    def add(self, state):
+        if state in self:
+            return
+        state.usage = max(0, min(state.usage, self.limit))
+        self.buckets[state.usage][state.handle] = state
+        self.remaining += self.limit - state.usage
+    
+    def discard(self, state):
+        if state in self:
+            del self.buckets[state.usage][state.handle]
+            self.remaining -= self.limit - state.usage
+    
+    def acquire(self):
+        """Take a slot on the least-used account; returns its state or None when all are full"""
+        for usage in range(self.limit):
+            bucket = self.buckets[usage]
+            if bucket:
+                state = next(iter(bucket.values()))
+                self._move(state, usage + 1)
+                return state
+        return None
+    
+    def release(self, state):
+        if not state.usage or state not in self:
+            return None
+        self._move(state, state.usage - 1)
+        return state.usage
+    
+    def _move(self, state, new_usage):
+        del self.buckets[state.usage][state.handle]
+        self.buckets[new_usage][state.handle] = state
+        self.remaining += state.usage - new_usage
+        state.usage = new_usage
+
+# Slot lease - one number's hold on an account slot
+class SlotLease:
+    __slots__ = ('lease_id', 'handle', 'phone', 'user_id', 'started', 'deadline', 'released')
+    
+    def __init__(self, lease_id, handle, phone, user_id, ttl):
+        self.lease_id = lease_id
+        self.handle = handle
+        self.phone = phone
+        self.user_id = user_id
+        self.started = time.time()
+        self.deadline = self.started + ttl
+        self.released = False
 
 # Account Manager
 class AccountManager:
@@ -805,89 +2270,263 @@ class AccountManager:
         self.accounts = load_accounts()
         print(f"📊 Loaded accounts for {len(self.accounts)} users")
         
-        # User-specific token management
-        self.user_tokens = {}  # user_id -> list of tokens
-        self.token_owners = {}  # token -> (user_id, username)
-        self.token_info = {}  # token -> {'username': '', 'api_user_id': '', 'usage': 0}
-        
-    async def initialize_user(self, user_id):
-        """Initialize accounts for a specific user"""
+        # User-specific token management; accounts are addressed by integer handle
+        self.tokens = {}  # handle -> TokenState
+        self.handles = {}  # (user_id, username) -> handle
+        self.user_handles = {}  # user_id -> handles of logged-in accounts, in account order
+        self.token_handles = {}  # current token -> handle, to attribute panel calls to a user
+        self.capacity = {}  # user_id -> CapacityIndex of that user's accounts
+        self._handle_seq = itertools.count(1)
+        self._init_tasks = {}  # user_id -> running initialize_user task
+        self.leases = {}  # lease_id -> SlotLease still holding a slot
+        self._lease_seq = itertools.count(1)
+        self.lease_stats = {'granted': 0, 'released': 0, 'reaped': 0}
+        self.slot_listeners = []  # called with user_id whenever a slot frees up
+        self.warmup = None  # result of the last warm_up_all run
+        
+    async def initialize_user(self, user_id, progress=None):
+        """Initialize accounts for a specific user; progress(done, total, ok) is awaited as accounts finish"""
         user_id_str = str(user_id)
         if user_id_str not in self.accounts:
             print(f"ℹ️ No accounts found for user {user_id}")
             return 0
             
         user_accounts = self.accounts[user_id_str]
-        valid_tokens = []
-        
-        print(f"🔄 Initializing {len(user_accounts)} accounts for user {user_id}")
-        
+        active = []
         for acc in user_accounts:
             if not acc.get('active', True):
                 print(f"⏭️ Skipping inactive account: {acc['username']}")
                 continue
-                
-            username = acc['username']
-            password = acc['password']
-            
-            if acc.get('token') and acc.get('api_user_id'):
-                print(f"🔍 Validating existing token for {username}")
-                # Validate existing token
-                is_valid = await self.validate_token(acc['token'])
-                if is_valid:
-                    print(f"✅ Token valid for {username}")
-                    valid_tokens.append((username, acc['token'], acc['api_user_id']))
-                else:
-                    print(f"🔄 Token invalid, re-logging in for {username}")
-                    # Try to login again
-                    new_token, api_user_id, nickname = await login_api_async(username, password)
-                    if new_token:
-                        acc['token'] = new_token
-                        acc['api_user_id'] = api_user_id
-                        acc['nickname'] = nickname
-                        acc['last_login'] = datetime.now().isoformat()
-                        valid_tokens.append((username, new_token, api_user_id))
-                        print(f"✅ Re-login successful for {username}")
-                    else:
-                        print(f"❌ Re-login failed for {username}")
-            else:
-                print(f"🔄 First time login for {username}")
-                # First time login
-                new_token, api_user_id, nickname = await login_api_async(username, password)
-                if new_token:
-                    acc['token'] = new_token
-                    acc['api_user_id'] = api_user_id
-                    acc['nickname'] = nickname
-                    acc['last_login'] = datetime.now().isoformat()
-                    valid_tokens.append((username, new_token, api_user_id))
-                    print(f"✅ First login successful for {username}")
-                else:
-                    print(f"❌ First login failed for {username}")
+            active.append(acc)
+        
+        print(f"🔄 Initializing {len(active)} accounts for user {user_id}")
+        
+        semaphore = asyncio.Semaphore(INIT_CONCURRENCY)
+        
+        async def init_account(acc):
+            async with semaphore:
+                try:
+                    return await asyncio.wait_for(self._init_account(acc), INIT_ACCOUNT_TIMEOUT)
+                except asyncio.TimeoutError:
+                    print(f"⏱️ Initialization timed out for {acc['username']}")
+                    return None
+                except Exception as e:
+                    print(f"❌ Initialization error for {acc['username']}: {e}")
+                    return None
+        
+        tasks = [asyncio.ensure_future(init_account(acc)) for acc in active]
+        done = 0
+        ok = 0
+        try:
+            for finished in asyncio.as_completed(tasks):
+                if await finished:
+                    ok += 1
+                done += 1
+                if progress:
+                    try:
+                        await progress(done, len(tasks), ok)
+                    except Exception as e:
+                        print(f"⚠️ Progress update failed: {e}")
+        finally:
+            for task in tasks:
+                task.cancel()
+        
+        # Write everything back in one batch, in account order
+        valid_tokens = []
+        logged_in = False
+        for acc, task in zip(active, tasks):
+            result = task.result() if not task.cancelled() else None
+            if not result:
+                continue
+            token, api_user_id, nickname, fresh = result
+            if fresh:
+                self.replace_token(user_id_str, acc['username'], token, api_user_id, nickname)
+                logged_in = True
+            valid_tokens.append((acc['username'], token, api_user_id))
         
         # Save updated tokens
-        save_accounts(self.accounts)
-        
-        # Store tokens for this user
-        self.user_tokens[user_id_str] = []
-        for username, token, api_user_id in valid_tokens:
-            self.user_tokens[user_id_str].append(token)
-            self.token_owners[token] = (user_id_str, username)
-            self.token_info[token] = {
-                'username': username,
-                'api_user_id': api_user_id,
-                'usage': 0
-            }
+        if logged_in:
+            save_accounts(self.accounts)
+        
+        # Store tokens for this user; accounts keep their handle and slots in use
+        handles = [self._add_token(user_id_str, username, token, api_user_id).handle
+                   for username, token, api_user_id in valid_tokens]
+        for handle in set(self.user_handles.get(user_id_str, [])) - set(handles):
+            self._drop(handle)
+        self.user_handles[user_id_str] = handles
         
         print(f"✅ Initialized {len(valid_tokens)} accounts for user {user_id}")
         return len(valid_tokens)
     
+    def _add_token(self, user_id_str, username, token, api_user_id):
+        """Put an account into the user's pool, reusing its handle if it has one"""
+        handle = self.handles.get((user_id_str, username))
+        state = self.tokens.get(handle)
+        if state is None:
+            handle = next(self._handle_seq)
+            state = TokenState(handle, token, username, api_user_id, user_id_str)
+            self.tokens[handle] = state
+            self.handles[(user_id_str, username)] = handle
+        elif state.token != token:
+            self.token_handles.pop(state.token, None)
+            state.set_token(token, api_user_id)
+        self.token_handles[token] = handle
+        
+        handles = self.user_handles.setdefault(user_id_str, [])
+        if handle not in handles:
+            handles.append(handle)
+        self.capacity.setdefault(user_id_str, CapacityIndex(MAX_PER_ACCOUNT)).add(state)
+        return state
+    
+    def _drop(self, handle):
+        state = self.tokens.pop(handle, None)
+        if state is None:
+            return
+        self.handles.pop((state.owner, state.username), None)
+        self.token_handles.pop(state.token, None)
+        handles = self.user_handles.get(state.owner, [])
+        if handle in handles:
+            handles.remove(handle)
+        if state.owner in self.capacity:
+            self.capacity[state.owner].discard(state)
+    
+    def remove_account(self, user_id_str, username):
+        """Drop an account from the user's pool and capacity index"""
+        handle = self.handles.get((user_id_str, username))
+        if handle is not None:
+            self._drop(handle)
+    
+    def state_for(self, handle):
+        return self.tokens.get(handle)
+    
+    def token_for(self, handle):
+        """Current JWT behind handle (follows refreshes), or None once the account is gone"""
+        state = self.tokens.get(handle)
+        return state.token if state else None
+    
+    def owner_of(self, token):
+        """user_id of the account behind token, or None for tokens not in any pool"""
+        state = self.tokens.get(self.token_handles.get(token))
+        return state.owner if state else None
+    
+    def first_state(self, user_id):
+        """State of the user's first logged-in account, used for account-level API calls"""
+        handles = self.user_handles.get(str(user_id))
+        return self.tokens.get(handles[0]) if handles else None
+    
+    async def warm_up_all(self, concurrency, stagger):
+        """Load token pools for every user: trust unexpired JWTs, stagger logins for the rest"""
+        started = time.monotonic()
+        timings = {}
+        
+        # Phase 1: tokens whose JWT exp is still ahead go straight into the pools, no probe
+        pending = []
+        trusted = 0
+        for user_id_str, user_accounts in self.accounts.items():
+            for acc in user_accounts:
+                if not acc.get('active', True):
+                    continue
+                token = acc.get('token')
+                if token and acc.get('api_user_id') and token_cache.check(token) is True:
+                    self._add_token(user_id_str, acc['username'], token, acc['api_user_id'])
+                    trusted += 1
+                elif acc.get('password'):
+                    pending.append((user_id_str, acc))
+        timings['trust'] = time.monotonic() - started
+        print(f"🔥 Warm-up: {trusted} tokens trusted, {len(pending)} need login")
+        
+        # Phase 2: staggered, bounded logins for expired or unknown tokens
+        phase_started = time.monotonic()
+        semaphore = asyncio.Semaphore(concurrency)
+        
+        async def login(index, user_id_str, acc):
+            await asyncio.sleep(index * stagger)
+            async with semaphore:
+                try:
+                    new_token, api_user_id, nickname = await asyncio.wait_for(
+                        panel_client.login(acc['username'], acc['password']), INIT_ACCOUNT_TIMEOUT
+                    )
+                except Exception as e:
+                    print(f"❌ Warm-up login error for {acc['username']}: {e}")
+                    return False
+            if not new_token:
+                return False
+            self.replace_token(user_id_str, acc['username'], new_token, api_user_id, nickname)
+            self._add_token(user_id_str, acc['username'], new_token, api_user_id)
+            return True
+        
+        results = await asyncio.gather(*[
+            login(index, user_id_str, acc) for index, (user_id_str, acc) in enumerate(pending)
+        ])
+        logged_in = len([ok for ok in results if ok])
+        timings['login'] = time.monotonic() - phase_started
+        
+        # Phase 3: one write for all refreshed tokens
+        phase_started = time.monotonic()
+        if logged_in:
+            save_accounts(self.accounts)
+        timings['save'] = time.monotonic() - phase_started
+        timings['total'] = time.monotonic() - started
+        
+        self.warmup = {
+            'finished': datetime.now(),
+            'users': len(self.user_handles),
+            'trusted': trusted,
+            'logged_in': logged_in,
+            'failed': len(pending) - logged_in,
+            'timings': timings
+        }
+        print(f"✅ Warm-up done in {timings['total']:.2f}s "
+              f"(trust {timings['trust']:.2f}s, login {timings['login']:.2f}s, save {timings['save']:.2f}s): "
+              f"{trusted} trusted, {logged_in} logged in, {len(pending) - logged_in} failed")
+        return self.warmup
+    
+    def start_initialize(self, user_id, progress=None):
+        """Run initialize_user in the background, joining a run already in progress"""
+        user_id_str = str(user_id)
+        task = self._init_tasks.get(user_id_str)
+        if task is not None and task.get_loop() is not asyncio.get_running_loop():
+            # Cut off by a bot restart; its done callback never ran
+            task = None
+        if task is None:
+            task = asyncio.create_task(self.initialize_user(user_id, progress))
+            self._init_tasks[user_id_str] = task
+            task.add_done_callback(lambda _: self._init_tasks.pop(user_id_str, None))
+        return task
+    
+    async def _init_account(self, acc):
+        """Validate or log in one account; returns (token, api_user_id, nickname, fresh) or None"""
+        username = acc['username']
+        
+        if acc.get('token') and acc.get('api_user_id'):
+            print(f"🔍 Validating existing token for {username}")
+            if await self.validate_token(acc['token']):
+                print(f"✅ Token valid for {username}")
+                return acc['token'], acc['api_user_id'], acc.get('nickname'), False
+            print(f"🔄 Token invalid, re-logging in for {username}")
+        else:
+            print(f"🔄 First time login for {username}")
+        
+        new_token, api_user_id, nickname = await panel_client.login(username, acc['password'])
+        if not new_token:
+            print(f"❌ Login failed for {username}")
+            return None
+        print(f"✅ Login successful for {username}")
+        return new_token, api_user_id, nickname, True
+    
     async def validate_token(self, token):
+        trusted = token_cache.check(token)
+        if trusted is not None:
+            token_cache.hits += 1
+            return trusted
+        
+        # Unknown (no exp, not used lately): fall back to a real probe
+        token_cache.probes += 1
         try:
-            async with aiohttp.ClientSession() as session:
-                status_code, _, _ = await get_status_async(session, token, "0000000000")
-                if status_code is not None and status_code != -1:
-                    return True
-            return False
+            status_code, _, _ = await panel_client.get_status(token, "0000000000")
+            # Only an explicit expiry counts; an API error or timeout (-2) is inconclusive,
+            # so keep the token rather than re-login every account during a panel hiccup
+            return status_code != -1
         except Exception as e:
             print(f"❌ Token validation error: {e}")
             return False
@@ -899,59 +2538,119 @@ class AccountManager:
             return len(active_accounts)
         return 0
     
-    def get_user_active_accounts_count(self, user_id):
-        user_id_str = str(user_id)
-        if user_id_str in self.user_tokens:
-            return len(self.user_tokens[user_id_str])
-        return 0
+    def get_user_active_accounts_count(self, user_id):
+        return len(self.user_handles.get(str(user_id), []))
     
     def get_user_remaining_checks(self, user_id):
-        user_id_str = str(user_id)
-        if user_id_str not in self.user_tokens:
-            return 0
-        
-        total_slots = len(self.user_tokens[user_id_str]) * MAX_PER_ACCOUNT
-        used_slots = sum(self.token_info.get(token, {}).get('usage', 0) for token in self.user_tokens[user_id_str])
-        remaining = max(0, total_slots - used_slots)
-        return remaining
+        index = self.capacity.get(str(user_id))
+        return index.remaining if index else 0
     
     def get_next_available_token(self, user_id):
-        user_id_str = str(user_id)
-        if user_id_str not in self.user_tokens or not self.user_tokens[user_id_str]:
+        index = self.capacity.get(str(user_id))
+        if not index:
             print(f"❌ No valid tokens available for user {user_id}")
             return None
         
-        available_tokens = []
-        for token in self.user_tokens[user_id_str]:
-            info = self.token_info.get(token, {})
-            usage = info.get('usage', 0)
-            if usage < MAX_PER_ACCOUNT:
-                available_tokens.append((token, usage))
-        
-        if not available_tokens:
+        # Least-used account with a free slot
+        state = index.acquire()
+        if not state:
             print(f"❌ All accounts are at maximum usage for user {user_id}")
             return None
         
-        # Select token with minimum usage
-        best_token, best_usage = min(available_tokens, key=lambda x: x[1])
-        self.token_info[best_token]['usage'] += 1
+        print(f"✅ Using token from {state.username}, usage: {state.usage}/{MAX_PER_ACCOUNT}")
         
-        username = self.token_info[best_token].get('username', 'Unknown')
-        print(f"✅ Using token from {username}, usage: {self.token_info[best_token]['usage']}/{MAX_PER_ACCOUNT}")
-        
-        return best_token, username
+        return state.handle, state.username
+    
+    def acquire_slot(self, user_id, phone, ttl=None):
+        """Lease a slot on the user's least-used account; returns (lease, username) or None"""
+        taken = self.get_next_available_token(user_id)
+        if not taken:
+            return None
+        handle, username = taken
+        if ttl is None:
+            ttl = TRACK_DEADLINE_SECONDS + SLOT_LEASE_GRACE
+        lease = SlotLease(next(self._lease_seq), handle, phone, user_id, ttl)
+        self.leases[lease.lease_id] = lease
+        self.lease_stats['granted'] += 1
+        return lease, username
+    
+    def extend_lease(self, lease, deadline):
+        """Keep the lease alive until at least deadline plus the grace period"""
+        lease.deadline = max(lease.deadline, deadline + SLOT_LEASE_GRACE)
+    
+    def release_lease(self, lease, reaped=False):
+        """Give the slot back once; later calls for the same lease are ignored"""
+        if lease.released:
+            return False
+        lease.released = True
+        self.leases.pop(lease.lease_id, None)
+        self.lease_stats['reaped' if reaped else 'released'] += 1
+        self.release_token(lease.handle)
+        for listener in self.slot_listeners:
+            listener(lease.user_id)
+        return True
+    
+    def reap_leases(self):
+        """Reclaim slots whose lease ran past its deadline without a release"""
+        now = time.time()
+        expired = [lease for lease in self.leases.values() if lease.deadline <= now]
+        for lease in expired:
+            print(f"♻️ Reclaimed leaked slot for {lease.phone} (held {now - lease.started:.0f}s)")
+            self.release_lease(lease, reaped=True)
+        return len(expired)
+    
+    async def run_lease_reaper(self, interval):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                self.reap_leases()
+            except Exception as e:
+                print(f"❌ Lease reaper error: {e}")
+    
+    def lease_snapshot(self):
+        now = time.time()
+        oldest = min((lease.started for lease in self.leases.values()), default=None)
+        return dict(self.lease_stats, active=len(self.leases),
+                    oldest_age=now - oldest if oldest else 0.0)
+    
+    def find_account(self, user_id_str, username):
+        for acc in self.accounts.get(user_id_str, []):
+            if acc['username'] == username:
+                return acc
+        return None
     
-    def release_token(self, token):
-        if token in self.token_info:
-            self.token_info[token]['usage'] = max(0, self.token_info[token]['usage'] - 1)
-            username = self.token_info[token].get('username', 'Unknown')
-            print(f"✅ Released token from {username}, usage: {self.token_info[token]['usage']}/{MAX_PER_ACCOUNT}")
+    def replace_token(self, user_id_str, username, new_token, api_user_id, nickname):
+        """Swap an account's token in one step; holders of its handle see the new one"""
+        acc = self.find_account(user_id_str, username)
+        if not acc:
+            return
+        old_token = acc.get('token')
+        acc['token'] = new_token
+        acc['api_user_id'] = api_user_id
+        acc['nickname'] = nickname
+        acc['last_login'] = datetime.now().isoformat()
+        if old_token and old_token != new_token:
+            token_cache.mark_invalid(old_token)
+        
+        state = self.tokens.get(self.handles.get((user_id_str, username)))
+        if state is not None:
+            self.token_handles.pop(state.token, None)
+            state.set_token(new_token, api_user_id)
+            self.token_handles[new_token] = state.handle
+    
+    def release_token(self, handle):
+        state = self.tokens.get(handle)
+        index = self.capacity.get(state.owner) if state else None
+        if index:
+            usage = index.release(state)
+            if usage is not None:
+                print(f"✅ Released token from {state.username}, usage: {usage}/{MAX_PER_ACCOUNT}")
     
     def get_all_users_stats(self):
         stats = {}
         for user_id_str, accounts in self.accounts.items():
             active_accounts = len([acc for acc in accounts if acc.get('active', True)])
-            logged_in_accounts = len(self.user_tokens.get(user_id_str, []))
+            logged_in_accounts = len(self.user_handles.get(user_id_str, []))
             stats[user_id_str] = {
                 'total_accounts': len(accounts),
                 'active_accounts': active_accounts,
@@ -959,21 +2658,299 @@ class AccountManager:
                 'username': accounts[0]['username'] if accounts else 'Unknown'
             }
         return stats
-    
-    def get_api_user_id_for_token(self, token):
-        """Get API user ID for a specific token"""
-        info = self.token_info.get(token, {})
-        return info.get('api_user_id')
 
 # Global account manager
 account_manager = AccountManager()
 
-# Track active numbers for OTP submission
-active_numbers = {}
+# Token keeper - refreshes live tokens before they expire
+class TokenKeeper:
+    def __init__(self, refresh_ahead, interval, concurrency, stagger):
+        self.refresh_ahead = refresh_ahead
+        self.interval = interval
+        self.stagger = stagger
+        self.concurrency = concurrency
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._refreshing = {}  # handle -> refresh task
+        self._task = None
+        self._loop = None
+        self.refreshed = 0
+        self.failed = 0
+        self.last_sweep = None
+    
+    def start(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # Bot restarted on a new event loop: re-logins running there died with it
+            self._refreshing = {}
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+            self._task = None
+            self._loop = loop
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+    
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+    
+    def is_due(self, state):
+        if time.time() < state.retry_at:
+            return False
+        if state.health != TOKEN_OK or token_cache.check(state.token) is False:
+            return True
+        return state.exp is not None and state.exp - time.time() <= self.refresh_ahead
+    
+    async def _run(self):
+        while True:
+            try:
+                await self.sweep()
+            except Exception as e:
+                print(f"❌ Token keeper sweep error: {e}")
+            await asyncio.sleep(self.interval)
+    
+    async def sweep(self):
+        """Refresh every live token that is close to expiry, staggered"""
+        self.last_sweep = datetime.now()
+        due = [state.handle for state in list(account_manager.tokens.values()) if self.is_due(state)]
+        if not due:
+            return 0
+        
+        print(f"🔑 Token keeper refreshing {len(due)} tokens")
+        results = await asyncio.gather(*[
+            self.refresh(handle, index * self.stagger) for index, handle in enumerate(due)
+        ])
+        refreshed = len([token for token in results if token])
+        if refreshed:
+            save_accounts(account_manager.accounts)
+        return refreshed
+    
+    def refresh(self, handle, delay=0):
+        """Start (or join) a re-login for one account; the task yields the new token or None"""
+        task = self._refreshing.get(handle)
+        if task is None:
+            task = asyncio.create_task(self._refresh(handle, delay))
+            self._refreshing[handle] = task
+            task.add_done_callback(lambda _: self._refreshing.pop(handle, None))
+        return task
+    
+    async def refresh_handle(self, handle, stale_token):
+        """Re-login the account right away after stale_token was rejected; returns the live token or None"""
+        state = account_manager.state_for(handle)
+        if state is None:
+            return None
+        if state.token != stale_token:
+            # Someone already refreshed it
+            return state.token
+        state.health = TOKEN_EXPIRED
+        if time.time() < state.retry_at:
+            # Recent logins failed; don't hammer the panel from every tracker
+            return None
+        new_token = await self.refresh(handle)
+        if new_token:
+            save_accounts(account_manager.accounts)
+        return new_token
+    
+    async def _refresh(self, handle, delay):
+        if delay:
+            await asyncio.sleep(delay)
+        state = account_manager.state_for(handle)
+        if state is None:
+            return None
+        username = state.username
+        acc = account_manager.find_account(state.owner, username)
+        if not acc or not acc.get('password'):
+            return None
+        
+        async with self._semaphore:
+            new_token, api_user_id, nickname = await panel_client.login(username, acc['password'])
+        
+        if not new_token:
+            state.health = TOKEN_FAILED
+            state.failures += 1
+            self.failed += 1
+            if state.failures >= TOKEN_KEEPER_MAX_FAILURES:
+                state.retry_at = float('inf')
+                print(f"❌ Token refresh failed for {username} {state.failures} times, waiting for a manual refresh")
+            else:
+                state.retry_at = time.time() + min(TOKEN_KEEPER_BACKOFF * 2 ** (state.failures - 1), TOKEN_KEEPER_BACKOFF_MAX)
+                print(f"❌ Token refresh failed for {username} (retry in {state.retry_at - time.time():.0f}s)")
+            return None
+        
+        account_manager.replace_token(state.owner, username, new_token, api_user_id, nickname)
+        self.refreshed += 1
+        print(f"🔑 Token refreshed for {username}")
+        return new_token
+
+token_keeper = TokenKeeper(TOKEN_REFRESH_AHEAD, TOKEN_KEEPER_INTERVAL, TOKEN_KEEPER_CONCURRENCY, TOKEN_KEEPER_STAGGER)
 
 # Track number status history to detect status changes
 number_status_history = {}
 
+# Number lifecycle states: add -> track -> OTP -> finalise
+NUMBER_ADDING = 'adding'
+NUMBER_TRACKING = 'tracking'
+NUMBER_AWAITING_OTP = 'awaiting_otp'  # In Progress, user may reply with OTP
+NUMBER_VERIFYING = 'verifying'  # OTP submitted, waiting for the panel verdict
+NUMBER_DONE = 'done'
+
+# Status tracking engine - one heap-driven asyncio task for every tracked number
+class Tracker:
+    __slots__ = (
+        'phone', 'lease', 'handle', 'username', 'user_id', 'chat_id', 'message_id', 'serial_number',
+        'state', 'record_id', 'counted_added',
+        'last_status', 'last_status_code', 'unchanged', 'deadline', 'fast_until',
+        'due', 'busy', 'cancelled', 'token_refreshed'
+    )
+    
+    def __init__(self, phone, lease, username, user_id, chat_id, message_id, serial_number=None):
+        now = time.time()
+        self.phone = phone
+        self.lease = lease
+        self.handle = lease.handle
+        self.username = username
+        self.user_id = user_id
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.serial_number = serial_number
+        self.state = NUMBER_ADDING
+        self.record_id = None
+        self.counted_added = False
+        self.last_status = '🔵 Processing...'
+        self.last_status_code = None
+        self.unchanged = 0
+        self.deadline = now + poll_backoff.deadline
+        self.fast_until = now + poll_backoff.fast_window
+        self.due = 0.0
+        self.busy = False
+        self.cancelled = False
+        self.token_refreshed = False
+
+class TrackingEngine:
+    def __init__(self, step, retire):
+        self.step = step  # async (tracker) -> next delay in seconds, or None when finished
+        self.retire = retire  # async (tracker) -> frees whatever a dropped tracker still holds
+        self.bot = None
+        self._heap = []  # (due, seq, tracker)
+        self._trackers = {}  # (user_id, phone) -> Tracker
+        self._seq = itertools.count()
+        self._wakeup = None
+        self._task = None
+        self._loop = None
+        self._running = 0
+    
+    def enqueue(self, tracker, delay=0.0):
+        """Schedule tracker's next step after delay seconds, replacing any earlier schedule"""
+        key = (tracker.user_id, tracker.phone)
+        current = self._trackers.get(key)
+        if current is not None and current is not tracker:
+            self._drop(current)
+        self._trackers[key] = tracker
+        tracker.cancelled = False
+        tracker.due = time.time() + delay
+        heapq.heappush(self._heap, (tracker.due, next(self._seq), tracker))
+        self._ensure_running()
+        if self._heap[0][2] is tracker:
+            self._wakeup.set()
+    
+    def cancel(self, user_id, phone):
+        tracker = self._trackers.pop((user_id, phone), None)
+        if tracker is not None:
+            self._drop(tracker)
+        return tracker
+    
+    def inspect(self, user_id, phone):
+        """Return user_id's live Tracker for phone, or None"""
+        return self._trackers.get((user_id, phone))
+    
+    def _drop(self, tracker):
+        tracker.cancelled = True
+        if not tracker.busy:
+            spawn_background(self.retire(tracker))
+        # A running step retires the tracker itself when it returns
+    
+    def snapshot(self):
+        return {
+            'tracked': len(self._trackers),
+            'scheduled': len(self._heap),
+            'running': self._running
+        }
+    
+    def start(self):
+        self._ensure_running()
+    
+    def _ensure_running(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # Bot restarted on a new event loop: the scheduler and any step running there died with it
+            self._loop = loop
+            self._task = None
+            self._running = 0
+            for tracker in self._trackers.values():
+                if tracker.busy:
+                    tracker.busy = False
+                    tracker.due = time.time()
+                    heapq.heappush(self._heap, (tracker.due, next(self._seq), tracker))
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+    
+    async def _run(self):
+        while True:
+            if not self._heap:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            
+            due, _, tracker = self._heap[0]
+            delay = due - time.time()
+            if delay > 0:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            
+            heapq.heappop(self._heap)
+            # Skip entries superseded by a later enqueue or a cancel
+            if tracker.cancelled or tracker.due != due:
+                continue
+            if tracker.busy:
+                # The running step picks this schedule up when it finishes
+                continue
+            tracker.due = 0.0
+            tracker.busy = True
+            spawn_background(self._step(tracker))
+    
+    async def _step(self, tracker):
+        self._running += 1
+        try:
+            delay = await self.step(tracker)
+        except Exception as e:
+            print(f"❌ Tracker step error for {tracker.phone}: {e}")
+            delay = None
+        finally:
+            self._running -= 1
+            tracker.busy = False
+        
+        if tracker.cancelled:
+            await self.retire(tracker)
+            return
+        if tracker.due and delay is not None:
+            # Re-enqueued while this step was running
+            self.enqueue(tracker, max(0.0, tracker.due - time.time()))
+            return
+        if delay is None:
+            key = (tracker.user_id, tracker.phone)
+            if self._trackers.get(key) is tracker:
+                del self._trackers[key]
+            return
+        self.enqueue(tracker, delay)
+
 # Handle OTP submission - FIXED: Count only when status changes to 1
 async def handle_otp_submission(update: Update, context: CallbackContext):
     user_id = update.effective_user.id
@@ -988,35 +2965,27 @@ async def handle_otp_submission(update: Update, context: CallbackContext):
             phone = phone_match.group(1)
             
             # Check if this number is active and belongs to the user
-            if phone in active_numbers and active_numbers[phone]['user_id'] == user_id:
+            tracker = tracking_engine.inspect(user_id, phone)
+            if (tracker is not None and
+                    tracker.state in (NUMBER_AWAITING_OTP, NUMBER_VERIFYING)):
                 # Check if OTP code is valid (4-6 digits)
                 if re.match(r'^\d{4,6}$', text):
-                    otp_data = active_numbers[phone]
-                    token = otp_data['token']
-                    username = otp_data['username']
-                    message_id = otp_data['message_id']
+                    token = account_manager.token_for(tracker.handle)
                     
                     # Submit OTP
                     processing_msg = await update.message.reply_text(f"🔄 Submitting OTP for {phone}...")
                     
-                    async with aiohttp.ClientSession() as session:
-                        success, message = await submit_otp_async(session, token, phone, text)
+                    success, message = await panel_client.submit_otp(token, phone, text)
                     
                     if success:
                         # ✅ OTP submit successful, but don't count success yet
                         # Wait for status to change to 1 in track_status_optimized
                         await processing_msg.delete()
                         
-                        # Check current status
-                        async with aiohttp.ClientSession() as session:
-                            status_code, status_name, record_id = await get_status_async(session, token, phone)
-                        
-                        if status_code is not None:
-                            await context.bot.edit_message_text(
-                                chat_id=update.effective_chat.id,
-                                message_id=message_id,
-                                text=f"{phone} {status_name}"
-                            )
+                        # The tracker's next poll reports the new status, so poll now and fast
+                        tracker.state = NUMBER_VERIFYING
+                        tracker.fast_until = time.time() + poll_backoff.fast_window
+                        tracking_engine.enqueue(tracker, 0)
                     else:
                         await processing_msg.edit_text(f"❌ OTP submission failed for {phone}: {message}")
                 else:
@@ -1028,98 +2997,112 @@ async def handle_otp_submission(update: Update, context: CallbackContext):
     else:
         await update.message.reply_text("❌ Please reply to a number message with OTP code.")
 
-async def track_status_optimized(context: CallbackContext):
-    data = context.job.data
-    phone = data['phone']
-    token = data['token']
-    username = data['username']
-    user_id = data['user_id']
-    checks = data['checks']
-    last_status = data.get('last_status', '🔵 Processing...')
-    serial_number = data.get('serial_number')
-    last_status_code = data.get('last_status_code')
+async def track_status_optimized(tracker):
+    """Run one status check for tracker; returns seconds until the next check, or None when done"""
+    phone = tracker.phone
+    handle = tracker.handle
+    # The token keeper may have swapped this account's token since the last step
+    token = account_manager.token_for(handle)
+    if token is None:
+        # Account was removed while the number was in flight
+        tracker.state = NUMBER_DONE
+        account_manager.release_lease(tracker.lease)
+        return None
+    username = tracker.username
+    user_id = tracker.user_id
+    last_status = tracker.last_status
+    serial_number = tracker.serial_number
+    last_status_code = tracker.last_status_code
+    bot = tracking_engine.bot
+    prefix = f"{serial_number}. " if serial_number else ""
+    
+    if panel_breaker.is_open():
+        # Panel is down: hold the tracker and its deadline until the breaker retries
+        pause = panel_breaker.retry_in()
+        tracker.deadline += pause
+        account_manager.extend_lease(tracker.lease, tracker.deadline)
+        if last_status != PANEL_PAUSED_STATUS:
+            tracker.last_status = PANEL_PAUSED_STATUS
+            try:
+                await bot.edit_message_text(
+                    chat_id=tracker.chat_id,
+                    message_id=tracker.message_id,
+                    text=f"{prefix}{phone} {PANEL_PAUSED_STATUS}"
+                )
+            except BadRequest as e:
+                if "Message is not modified" not in str(e):
+                    print(f"❌ Message update failed for {phone}: {e}")
+        return pause
     
     try:
-        async with aiohttp.ClientSession() as session:
-            status_code, status_name, record_id = await get_status_async(session, token, phone)
+        direct = tracker.state == NUMBER_VERIFYING and time.time() < tracker.fast_until
+        if direct:
+            # Right after an OTP submit: check the result directly on the priority lane
+            status_code, status_name, record_id = await panel_client.get_status(token, phone, priority=True)
+        else:
+            status_code, status_name, record_id = await status_poller.get_status(token, phone)
+        
+        if record_id:
+            tracker.record_id = record_id
+        
+        if status_code == -2 and panel_breaker.is_open():
+            # The breaker turned this poll away; step again to take the pause path
+            return 0
         
-        prefix = f"{serial_number}. " if serial_number else ""
+        if status_code == -1 and not tracker.token_refreshed:
+            # Expired mid-tracking: re-login once in the background flow and keep going
+            tracker.token_refreshed = True
+            if await token_keeper.refresh_handle(handle, token):
+                return 0
         
         if status_code == -1:
-            account_manager.release_token(token)
+            tracker.state = NUMBER_DONE
+            account_manager.release_lease(tracker.lease)
             error_text = f"{prefix}{phone} ❌ Token Error (Auto-Retry)"
             try:
-                await context.bot.edit_message_text(
-                    chat_id=data['chat_id'], 
-                    message_id=data['message_id'],
+                await bot.edit_message_text(
+                    chat_id=tracker.chat_id, 
+                    message_id=tracker.message_id,
                     text=error_text
                 )
             except BadRequest as e:
                 if "Message is not modified" not in str(e):
                     print(f"❌ Message update failed for {phone}: {e}")
-            return
+            return None
         
-        # Store active number for OTP submission if status is 2 (In Progress)
+        # Number is ready for OTP submission once status is 2 (In Progress)
         if status_code == 2:  # In Progress
-            active_numbers[phone] = {
-                'token': token,
-                'username': username,
-                'message_id': data['message_id'],
-                'user_id': user_id
-            }
+            if tracker.state == NUMBER_TRACKING:
+                tracker.state = NUMBER_AWAITING_OTP
+            
+            # Count the number as added the first time it reaches In Progress
+            if not tracker.counted_added:
+                tracker.counted_added = True
+                user_id_str = str(user_id)
+                
+                # Per-user added count plus global stats
+                record_event('added', user_id_str, phone)
+                
+                print(f"✅ Added count increased for user {user_id_str} - Number: {phone} (Status: {status_code})")
         
         # ✅ IMPORTANT: Check if status changed from non-1 to 1 (Success)
         if status_code == 1 and last_status_code != 1:
-            # Load tracking data
-            tracking = load_tracking()
             user_id_str = str(user_id)
             
-            # Check if this number already had success TODAY (DUPLICATE CHECK)
-            if phone in tracking.get("today_success", {}):
-                # Already had success today - just log, NO COUNT
-                print(f"ℹ️ Number {phone} already had success today, skipping count")
-            else:
-                # First time success today for this number
+            # DUPLICATE CHECK against today's successes, then count
+            if record_event('success', user_id_str, phone, username=username):
                 print(f"🎉 First time SUCCESS today for {phone} by user {user_id_str}")
-                
-                # Update OTP stats
-                otp_stats = load_otp_stats()
-                otp_stats["total_success"] += 1
-                otp_stats["today_success"] += 1
-                
-                # Update user stats
-                if user_id_str not in otp_stats["user_stats"]:
-                    otp_stats["user_stats"][user_id_str] = {
-                        "total_success": 0,
-                        "today_success": 0,
-                        "yesterday_success": 0,
-                        "username": username,
-                        "full_name": ""
-                    }
-                otp_stats["user_stats"][user_id_str]["total_success"] += 1
-                otp_stats["user_stats"][user_id_str]["today_success"] += 1
-                
-                # ✅ SIMPLE TRACKING: phone -> user_id mapping
-                tracking["today_success"][phone] = user_id_str
-                
-                # ✅ Also track counts per user
-                if "today_success_counts" not in tracking:
-                    tracking["today_success_counts"] = {}
-                
-                if user_id_str not in tracking["today_success_counts"]:
-                    tracking["today_success_counts"][user_id_str] = 0
-                tracking["today_success_counts"][user_id_str] += 1
-                
-                save_otp_stats(otp_stats)
-                save_tracking(tracking)
                 print(f"✅ Success count updated for user {user_id_str} - Number: {phone}")
+            else:
+                # Already had success today - just log, NO COUNT
+                print(f"ℹ️ Number {phone} already had success today, skipping count")
         
         if status_name != last_status:
             new_text = f"{prefix}{phone} {status_name}"
             try:
-                await context.bot.edit_message_text(
-                    chat_id=data['chat_id'], 
-                    message_id=data['message_id'],
+                await bot.edit_message_text(
+                    chat_id=tracker.chat_id, 
+                    message_id=tracker.message_id,
                     text=new_text
                 )
             except BadRequest as e:
@@ -1128,97 +3111,111 @@ async def track_status_optimized(context: CallbackContext):
         
         final_states = [0, 1, 4, 7, 6, 8, 9, 10, 11, 12, 13, 14, 15, 16]
         if status_code in final_states:
-            account_manager.release_token(token)
-            # Remove from active numbers if exists
-            if phone in active_numbers:
-                del active_numbers[phone]
+            tracker.state = NUMBER_DONE
+            account_manager.release_lease(tracker.lease)
             
             # ✅ শুধুমাত্র স্ট্যাটাস 1 এবং 2 ছাড়া বাকি সব স্ট্যাটাসে ডিলিট হবে
             if status_code not in [1, 2]:
-                deleted_count = await delete_number_from_all_accounts_optimized(phone, user_id)
+                deleted_count = await delete_number_from_all_accounts_optimized(phone, user_id, token, tracker.record_id)
             
             final_text = f"{prefix}{phone} {status_name}"
             try:
-                await context.bot.edit_message_text(
-                    chat_id=data['chat_id'], 
-                    message_id=data['message_id'],
+                await bot.edit_message_text(
+                    chat_id=tracker.chat_id, 
+                    message_id=tracker.message_id,
                     text=final_text
                 )
             except BadRequest as e:
                 if "Message is not modified" not in str(e):
                     print(f"❌ Final message update failed for {phone}: {e}")
-            return
+            return None
         
-        if checks >= 150:
-            account_manager.release_token(token)
-            # Remove from active numbers if exists
-            if phone in active_numbers:
-                del active_numbers[phone]
+        now = time.time()
+        if now >= tracker.deadline:
+            tracker.state = NUMBER_DONE
+            account_manager.release_lease(tracker.lease)
             
             # ✅ এখানেও স্ট্যাটাস 1 এবং 2 এর জন্য ডিলিট বন্ধ করুন
             if status_code not in [1, 2]:
-                deleted_count = await delete_number_from_all_accounts_optimized(phone, user_id)
+                deleted_count = await delete_number_from_all_accounts_optimized(phone, user_id, token, tracker.record_id)
             
             timeout_text = f"{prefix}{phone} 🟡 Try leter "
             try:
-                await context.bot.edit_message_text(
-                    chat_id=data['chat_id'], 
-                    message_id=data['message_id'],
+                await bot.edit_message_text(
+                    chat_id=tracker.chat_id, 
+                    message_id=tracker.message_id,
                     text=timeout_text
                 )
             except BadRequest as e:
                 if "Message is not modified" not in str(e):
                     print(f"❌ Timeout message update failed for {phone}: {e}")
-            return
+            return None
         
-        if context.job_queue:
-            context.job_queue.run_once(
-                track_status_optimized, 
-                1,
-                data={
-                    **data, 
-                    'checks': checks + 1, 
-                    'last_status': status_name,
-                    'last_status_code': status_code
-                }
-            )
-        else:
-            print("❌ JobQueue not available, cannot schedule status check")
+        tracker.unchanged = tracker.unchanged + 1 if status_code == last_status_code else 0
+        tracker.last_status = status_name
+        tracker.last_status_code = status_code
+        delay = poll_backoff.next_delay(status_code, tracker.unchanged, now < tracker.fast_until)
+        
+        # A poller tick adds up to one interval on top of the delay; direct checks get no such pacing
+        slack = 0.0 if direct else status_poller.interval
+        return max(0.0, min(delay, tracker.deadline - now) - slack)
     except Exception as e:
         print(f"❌ Tracking error for {phone}: {e}")
-        account_manager.release_token(token)
+        tracker.state = NUMBER_DONE
+        account_manager.release_lease(tracker.lease)
+        return None
+
+async def retire_tracker(tracker):
+    """Finish a tracker replaced by a newer add of the same number: free its slot and close its message"""
+    finished = tracker.state == NUMBER_DONE
+    tracker.state = NUMBER_DONE
+    account_manager.release_lease(tracker.lease)
+    if finished:
+        return
+    prefix = f"{tracker.serial_number}. " if tracker.serial_number else ""
+    try:
+        await tracking_engine.bot.edit_message_text(
+            chat_id=tracker.chat_id,
+            message_id=tracker.message_id,
+            text=f"{prefix}{tracker.phone} 🔁 Added Again"
+        )
+    except Exception as e:
+        print(f"❌ Message update failed for {tracker.phone}: {e}")
+
+tracking_engine = TrackingEngine(track_status_optimized, retire_tracker)
 
 # Delete number from all accounts of a specific user
-async def delete_number_from_all_accounts_optimized(phone, user_id):
-    accounts = load_accounts()
+async def delete_number_from_all_accounts_optimized(phone, user_id, known_token=None, known_record_id=None):
+    """Delete phone from every account of user_id; known_token/known_record_id skip one status lookup"""
+    accounts = account_manager.accounts
     user_id_str = str(user_id)
     deleted_count = 0
     
     if user_id_str not in accounts:
         return 0
     
-    async with aiohttp.ClientSession() as session:
-        tasks = []
-        for account in accounts[user_id_str]:
-            if account.get("token"):
-                tasks.append(delete_if_exists(session, account["token"], phone, account['username']))
-        if tasks:
-            results = await asyncio.gather(*tasks, return_exceptions=True)
-            for i, result in enumerate(results):
-                if result is True:
-                    deleted_count += 1
-        stats = load_stats()
-        stats["total_deleted"] += deleted_count
-        stats["today_deleted"] += deleted_count
-        save_stats(stats)
-        print(f"✅ Deleted {phone} from {deleted_count} accounts of user {user_id}")
-        return deleted_count
-
-async def delete_if_exists(session, token, phone, username):
+    tasks = []
+    for account in accounts[user_id_str]:
+        if not account.get("token"):
+            continue
+        if known_record_id and account["token"] == known_token:
+            tasks.append(panel_client.delete_number(known_token, known_record_id, account['username']))
+        else:
+            tasks.append(delete_if_exists(account["token"], phone, account['username']))
+    if tasks:
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        for i, result in enumerate(results):
+            if result is True:
+                deleted_count += 1
+    record_event('deleted', user_id_str, phone, count=deleted_count)
+    print(f"✅ Deleted {phone} from {deleted_count} accounts of user {user_id}")
+    return deleted_count
+
+async def delete_if_exists(token, phone, username):
     try:
-        status_code, _, record_id = await get_status_async(session, token, phone)
+        status_code, _, record_id = await panel_client.get_status(token, phone)
         if record_id:
-            return await delete_single_number_async(session, token, record_id, username)
+            return await panel_client.delete_number(token, record_id, username)
         return True
     except Exception as e:
         print(f"❌ Delete check error for {phone} in {username}: {e}")
@@ -1231,14 +3228,15 @@ async def show_user_settlements(update: Update, context: CallbackContext):
     user_id_str = str(user_id)
     
     # Get user's first account token
-    if user_id_str not in account_manager.user_tokens or not account_manager.user_tokens[user_id_str]:
+    state = account_manager.first_state(user_id_str)
+    if not state:
         await update.message.reply_text("❌ No active accounts found!")
         return
     
-    token = account_manager.user_tokens[user_id_str][0]
+    token = state.token
     
     # Get API user ID from token
-    api_user_id = account_manager.get_api_user_id_for_token(token)
+    api_user_id = state.api_user_id
     
     if not api_user_id:
         await update.message.reply_text(
@@ -1259,8 +3257,7 @@ async def show_user_settlements(update: Update, context: CallbackContext):
     
     processing_msg = await update.message.reply_text("🔄 Loading your settlement records...")
     
-    async with aiohttp.ClientSession() as session:
-        data, error = await get_user_settlements(session, token, str(api_user_id), page=page, page_size=5)
+    data, error = await panel_client.get_user_settlements(token, str(api_user_id), page=page, page_size=5)
     
     if error:
         await processing_msg.edit_text(f"❌ Error loading settlements: {error}")
@@ -1351,11 +3348,12 @@ async def show_admin_billing_list(update: Update, context: CallbackContext):
     
     # Get admin's first account token
     user_id_str = str(ADMIN_ID)
-    if user_id_str not in account_manager.user_tokens or not account_manager.user_tokens[user_id_str]:
+    state = account_manager.first_state(user_id_str)
+    if not state:
         await update.message.reply_text("❌ No active accounts found!")
         return
     
-    token = account_manager.user_tokens[user_id_str][0]
+    token = state.token
     
     # Get page number from command args
     page = 1
@@ -1369,8 +3367,7 @@ async def show_admin_billing_list(update: Update, context: CallbackContext):
     
     processing_msg = await update.message.reply_text("🔄 Loading billing list...")
     
-    async with aiohttp.ClientSession() as session:
-        data, error = await get_all_billing_list(session, token, page=page, page_size=15)
+    data, error = await panel_client.get_billing_list(token, page=page, page_size=15)
     
     if error:
         await processing_msg.edit_text(f"❌ Error loading billing list: {error}")
@@ -1466,7 +3463,7 @@ async def set_settlement_rate(update: Update, context: CallbackContext):
                 await update.message.reply_text("❌ Please provide a notice message!")
                 return
             
-            accounts = load_accounts()
+            accounts = account_manager.accounts
             sent_count = 0
             
             processing_msg = await update.message.reply_text(f"📢 Sending notice to all users...")
@@ -1580,7 +3577,7 @@ async def set_settlement_rate(update: Update, context: CallbackContext):
             f"⏳ **Status:** Initializing users..."
         )
         
-        accounts = load_accounts()
+        accounts = account_manager.accounts
         all_users_summary = []
         total_users = 0
         total_usd = 0
@@ -1621,14 +3618,12 @@ async def set_settlement_rate(update: Update, context: CallbackContext):
             user_token = None
             token_refreshed = False
             
-            if user_id_str in account_manager.user_tokens and account_manager.user_tokens[user_id_str]:
-                user_token = account_manager.user_tokens[user_id_str][0]
+            first = account_manager.first_state(user_id_str)
+            if first:
+                user_token = first.token
                 
                 # Validate token
-                async with aiohttp.ClientSession() as session:
-                    status_code, _, _ = await get_status_async(session, user_token, "0000000000")
-                
-                if status_code == -1:
+                if not await account_manager.validate_token(user_token):
                     user_token = None
             
             # If no valid token, try to login
@@ -1637,12 +3632,9 @@ async def set_settlement_rate(update: Update, context: CallbackContext):
                     if not acc.get('active', True):
                         continue
                     
-                    token, api_user_id, nickname = await login_api_async(acc['username'], acc['password'])
+                    token, api_user_id, nickname = await panel_client.login(acc['username'], acc['password'])
                     if token:
-                        acc['token'] = token
-                        acc['api_user_id'] = api_user_id
-                        acc['nickname'] = nickname
-                        acc['last_login'] = datetime.now().isoformat()
+                        account_manager.replace_token(user_id_str, acc['username'], token, api_user_id, nickname)
                         
                         user_token = token
                         token_refreshed = True
@@ -1669,8 +3661,7 @@ async def set_settlement_rate(update: Update, context: CallbackContext):
             
             # STEP 2: Fetch settlements with country filter
             try:
-                async with aiohttp.ClientSession() as session:
-                    settlement_data, error = await get_user_settlements(session, user_token, str(api_user_id), page=1, page_size=100)
+                settlement_data, error = await panel_client.get_user_settlements(user_token, str(api_user_id), page=1, page_size=100)
                 
                 if error or not settlement_data or not settlement_data.get('records'):
                     continue
@@ -2008,16 +3999,16 @@ async def admin_view_user_settlements(update: Update, context: CallbackContext):
     
     # Get admin's first account token
     user_id_str = str(ADMIN_ID)
-    if user_id_str not in account_manager.user_tokens or not account_manager.user_tokens[user_id_str]:
+    state = account_manager.first_state(user_id_str)
+    if not state:
         await update.message.reply_text("❌ No active accounts found!")
         return
     
-    token = account_manager.user_tokens[user_id_str][0]
+    token = state.token
     
     processing_msg = await update.message.reply_text(f"🔄 Loading settlements for user {target_user_id}...")
     
-    async with aiohttp.ClientSession() as session:
-        data, error = await get_user_settlements(session, token, target_user_id, page=page, page_size=5)
+    data, error = await panel_client.get_user_settlements(token, target_user_id, page=page, page_size=5)
     
     if error:
         await processing_msg.edit_text(f"❌ Error loading settlements: {error}")
@@ -2099,14 +4090,15 @@ async def handle_settlement_callback(update: Update, context: CallbackContext):
         user_id_str = str(user_id)
         
         # Get user's first account token
-        if user_id_str not in account_manager.user_tokens or not account_manager.user_tokens[user_id_str]:
+        state = account_manager.first_state(user_id_str)
+        if not state:
             await query.edit_message_text("❌ No active accounts found!")
             return
         
-        token = account_manager.user_tokens[user_id_str][0]
+        token = state.token
         
         # Get API user ID from token
-        api_user_id = account_manager.get_api_user_id_for_token(token)
+        api_user_id = state.api_user_id
         
         if not api_user_id:
             await query.edit_message_text(
@@ -2115,8 +4107,7 @@ async def handle_settlement_callback(update: Update, context: CallbackContext):
             )
             return
         
-        async with aiohttp.ClientSession() as session:
-            data_result, error = await get_user_settlements(session, token, str(api_user_id), page=page, page_size=5)
+        data_result, error = await panel_client.get_user_settlements(token, str(api_user_id), page=page, page_size=5)
         
         if error:
             await query.edit_message_text(f"❌ Error loading settlements: {error}")
@@ -2208,14 +4199,14 @@ async def handle_settlement_callback(update: Update, context: CallbackContext):
         
         # Get admin's first account token
         user_id_str = str(ADMIN_ID)
-        if user_id_str not in account_manager.user_tokens or not account_manager.user_tokens[user_id_str]:
+        state = account_manager.first_state(user_id_str)
+        if not state:
             await query.edit_message_text("❌ No active accounts found!")
             return
         
-        token = account_manager.user_tokens[user_id_str][0]
+        token = state.token
         
-        async with aiohttp.ClientSession() as session:
-            data_result, error = await get_all_billing_list(session, token, page=page, page_size=15)
+        data_result, error = await panel_client.get_billing_list(token, page=page, page_size=15)
         
         if error:
             await query.edit_message_text(f"❌ Error loading billing list: {error}")
@@ -2294,14 +4285,14 @@ async def handle_settlement_callback(update: Update, context: CallbackContext):
         
         # Get admin's first account token
         user_id_str = str(ADMIN_ID)
-        if user_id_str not in account_manager.user_tokens or not account_manager.user_tokens[user_id_str]:
+        state = account_manager.first_state(user_id_str)
+        if not state:
             await query.edit_message_text("❌ No active accounts found!")
             return
         
-        token = account_manager.user_tokens[user_id_str][0]
+        token = state.token
         
-        async with aiohttp.ClientSession() as session:
-            data_result, error = await get_user_settlements(session, token, target_user_id, page=page, page_size=5)
+        data_result, error = await panel_client.get_user_settlements(token, target_user_id, page=page, page_size=5)
         
         if error:
             await query.edit_message_text(f"❌ Error loading settlements: {error}")
@@ -2383,14 +4374,14 @@ async def admin_add_account(update: Update, context: CallbackContext) -> None:
         
         # Try to login first to verify credentials
         processing_msg = await update.message.reply_text(f"🔄 Verifying account `{username}`...")
-        token, api_user_id, nickname = await login_api_async(username, password)
+        token, api_user_id, nickname = await panel_client.login(username, password)
         
         if not token:
             await processing_msg.edit_text(f"❌ Login failed for `{username}`! Please check credentials.")
             return
             
         # Add account to database
-        accounts = load_accounts()
+        accounts = account_manager.accounts
         user_id_str = str(target_user_id)
         
         if user_id_str not in accounts:
@@ -2426,7 +4417,7 @@ async def admin_add_account(update: Update, context: CallbackContext) -> None:
         save_accounts(accounts)
         
         # Initialize account for user if they are currently active
-        if user_id_str in account_manager.user_tokens:
+        if user_id_str in account_manager.user_handles:
             await account_manager.initialize_user(int(target_user_id))
         
         await processing_msg.edit_text(
@@ -2454,7 +4445,7 @@ async def admin_remove_account(update: Update, context: CallbackContext) -> None
         target_user_id = context.args[0]
         username = context.args[1]
         
-        accounts = load_accounts()
+        accounts = account_manager.accounts
         user_id_str = str(target_user_id)
         
         if user_id_str not in accounts:
@@ -2468,10 +4459,7 @@ async def admin_remove_account(update: Update, context: CallbackContext) -> None
             if acc['username'] == username:
                 removed = True
                 # Remove token from active tokens if exists
-                if acc.get('token') and acc['token'] in account_manager.token_info:
-                    del account_manager.token_info[acc['token']]
-                if acc.get('token') and acc['token'] in account_manager.token_owners:
-                    del account_manager.token_owners[acc['token']]
+                account_manager.remove_account(user_id_str, username)
             else:
                 new_accounts.append(acc)
         
@@ -2479,13 +4467,6 @@ async def admin_remove_account(update: Update, context: CallbackContext) -> None
             accounts[user_id_str] = new_accounts
             save_accounts(accounts)
             
-            # Update user tokens
-            if user_id_str in account_manager.user_tokens:
-                account_manager.user_tokens[user_id_str] = [
-                    token for token in account_manager.user_tokens[user_id_str] 
-                    if token not in account_manager.token_info
-                ]
-            
             await update.message.reply_text(
                 f"✅ Account removed successfully!\n\n"
                 f"👤 User ID: `{target_user_id}`\n"
@@ -2502,7 +4483,7 @@ async def admin_list_accounts(update: Update, context: CallbackContext) -> None:
         await update.message.reply_text("❌ Admin only command!")
         return
         
-    accounts = load_accounts()
+    accounts = account_manager.accounts
     
     if not accounts:
         await update.message.reply_text("❌ No accounts in database!")
@@ -2615,7 +4596,7 @@ async def admin_user_stats(update: Update, context: CallbackContext) -> None:
     
     processing_msg = await update.message.reply_text("🔄 Loading user statistics...")
     
-    accounts = load_accounts()
+    accounts = account_manager.accounts
     otp_stats = load_otp_stats()
     tracking = load_tracking()
     
@@ -2714,6 +4695,120 @@ async def admin_user_stats(update: Update, context: CallbackContext) -> None:
     else:
         await processing_msg.edit_text(message)
 
+# Panel traffic health for admin
+async def admin_panel_stats(update: Update, context: CallbackContext) -> None:
+    if update.effective_user.id != ADMIN_ID:
+        await update.message.reply_text("❌ Admin only command!")
+        return
+    
+    limiter = panel_limiter.stats()
+    breaker = panel_breaker.stats()
+    engine = tracking_engine.snapshot()
+    
+    breaker_icons = {BREAKER_CLOSED: "🟢", BREAKER_OPEN: "🔴", BREAKER_HALF_OPEN: "🟡"}
+    
+    message = "🛰️ Panel Health 👑\n\n"
+    message += f"{breaker_icons.get(breaker['state'], '⚪')} Circuit: {breaker['state']}"
+    if breaker['retry_in']:
+        message += f" (retry in {breaker['retry_in']:.0f}s)"
+    message += f"\n• Error rate: {breaker['error_rate'] * 100:.0f}% of {breaker['samples']} | Trips: {breaker['trips']}\n\n"
+    message += "🚦 Limiter:\n"
+    message += f"• Concurrency: {limiter['inflight']}/{limiter['limit']} (waiting {limiter['waiting']})\n"
+    message += f"• Requests: {limiter['requests']} | Backoffs: {limiter['decreases']}\n"
+    message += f"• Wait avg/p95/max: {limiter['avg_wait']:.2f}s / {limiter['p95_wait']:.2f}s / {limiter['max_wait']:.2f}s\n"
+    waiting = sorted(panel_limiter._waiters.waiting_by_key().items(), key=lambda item: -item[1])[:3]
+    if waiting:
+        message += "• Top waiting: " + ", ".join(f"{key or 'system'} ({count})" for key, count in waiting) + "\n"
+    message += f"• OTP lane: {panel_limiter.priority_inflight}/{panel_limiter.priority_slots} in use\n"
+    message += f"• Coalesced: {panel_client.single_flight.shared} of {panel_client.single_flight.calls + panel_client.single_flight.shared} calls\n\n"
+    leases = account_manager.lease_snapshot()
+    message += "🎟️ Slot leases:\n"
+    message += f"• Active: {leases['active']} (oldest {leases['oldest_age']:.0f}s)\n"
+    message += f"• Granted: {leases['granted']} | Released: {leases['released']} | Reaped: {leases['reaped']}\n\n"
+    adds = add_pipeline.stats()
+    message += "➕ Add pipeline:\n"
+    message += f"• Queue: {adds['depth']} (peak {adds['max_depth']}) | Workers busy: {adds['busy']}/{adds['workers']}\n"
+    message += f"• Submitted: {adds['submitted']} | Done: {adds['completed']} | Failed: {adds['failed']}\n\n"
+    message += "⏳ Waiting queue:\n"
+    message += f"• Waiting: {waiting_queue.total()} numbers from {len(waiting_queue.queues)} users\n"
+    message += f"• Queued: {waiting_queue.enqueued} | Dispatched: {waiting_queue.dispatched} | Expired: {waiting_queue.expired}\n\n"
+    message += f"💾 Storage: {storage.path}\n"
+    message += f"• Counters: {len(counter_cache.pending)} pending | {counter_cache.flushes} flushes"
+    if counter_cache.requeued:
+        message += f" | {counter_cache.requeued} re-queued"
+    message += "\n"
+    message += f"• Writer: {storage_writer.pending()} queued | {storage_writer.written} written | "
+    message += f"{storage_writer.coalesced} coalesced | {storage_writer.failed} failed\n"
+    message += f"• Journal: {journal.appended} appended | {journal.compactions} compactions"
+    if counter_cache.replayed:
+        message += f" | {counter_cache.replayed} replayed at start"
+    message += "\n\n"
+    message += "⏱️ Panel latency:\n"
+    message += f"• OTP lane: {panel_client.latency['priority'].summary()}\n"
+    message += f"• Normal: {panel_client.latency['normal'].summary()}\n\n"
+    message += "📡 Tracking:\n"
+    message += f"• Tracked numbers: {engine['tracked']} (running {engine['running']})\n"
+    message += f"• Waiting for status tick: {status_poller.pending_count()}\n\n"
+    message += "🔑 Tokens:\n"
+    message += f"• Validity checks: {token_cache.hits} cached, {token_cache.probes} probed\n"
+    message += f"• Keeper refreshes: {token_keeper.refreshed} ok, {token_keeper.failed} failed"
+    held = len([state for state in account_manager.tokens.values() if state.retry_at == float('inf')])
+    if held:
+        message += f", {held} held for manual refresh"
+    if token_keeper.last_sweep:
+        message += f" (last sweep {token_keeper.last_sweep.strftime('%H:%M:%S')})"
+    message += "\n"
+    warmup = account_manager.warmup
+    if warmup:
+        timings = warmup['timings']
+        message += f"• Boot warm-up: {warmup['users']} users in {timings['total']:.1f}s "
+        message += f"(trust {timings['trust']:.2f}s, login {timings['login']:.1f}s, save {timings['save']:.2f}s)\n"
+        message += f"  {warmup['trusted']} trusted, {warmup['logged_in']} logged in, {warmup['failed']} failed\n"
+    message += f"\n⏰ {datetime.now().strftime('%H:%M:%S')}"
+    
+    await update.message.reply_text(message)
+
+async def admin_set_weight(update: Update, context: CallbackContext) -> None:
+    if update.effective_user.id != ADMIN_ID:
+        await update.message.reply_text("❌ Admin only command!")
+        return
+    
+    settings = load_settings()
+    weights = settings.setdefault('user_weights', {})
+    
+    if not context.args or len(context.args) < 2:
+        message = (
+            f"⚖️ Usage: `/setweight user_id weight`\n"
+            f"Example: `/setweight 123456789 3` (3x panel share, default {FAIR_DEFAULT_WEIGHT:g})\n\n"
+        )
+        if weights:
+            message += "Current weights:\n"
+            for user_id_str, weight in sorted(weights.items(), key=lambda item: -item[1]):
+                message += f"• `{user_id_str}`: {weight:g}\n"
+        else:
+            message += "All users on the default weight."
+        await update.message.reply_text(message)
+        return
+    
+    target_user_id = context.args[0]
+    try:
+        weight = float(context.args[1])
+    except ValueError:
+        await update.message.reply_text("❌ Weight must be a number!")
+        return
+    if not 0 < weight <= FAIR_MAX_WEIGHT:
+        await update.message.reply_text(f"❌ Weight must be between 0 and {FAIR_MAX_WEIGHT:g}!")
+        return
+    
+    if weight == FAIR_DEFAULT_WEIGHT:
+        weights.pop(target_user_id, None)
+    else:
+        weights[target_user_id] = weight
+    save_settings(settings)
+    panel_limiter.set_weights(weights)
+    
+    await update.message.reply_text(f"✅ Panel weight for `{target_user_id}` set to {weight:g}")
+
 # Handle userstats pagination callbacks
 async def handle_userstats_callback(update: Update, context: CallbackContext):
     query = update.callback_query
@@ -2729,14 +4824,81 @@ async def handle_userstats_callback(update: Update, context: CallbackContext):
     context.args = [str(page)]
     await admin_user_stats(update, context)
 
+# Deferred sender - messages nobody waits for go out after the handler replies
+class DeferredSender:
+    def __init__(self, maxsize, attempts):
+        self.bot = None
+        self.attempts = attempts
+        self._queue = asyncio.Queue(maxsize)
+        self._task = None
+        self._loop = None
+        self.sent = 0
+        self.dropped = 0
+    
+    def start(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # Bot restarted on a new event loop: carry unsent messages over to a queue bound to this one
+            queue = asyncio.Queue(self._queue.maxsize)
+            while not self._queue.empty():
+                queue.put_nowait(self._queue.get_nowait())
+            self._queue, self._task, self._loop = queue, None, loop
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+    
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+    
+    def send(self, chat_id, text, **kwargs):
+        try:
+            self._queue.put_nowait((chat_id, text, kwargs))
+        except asyncio.QueueFull:
+            self.dropped += 1
+            print(f"⚠️ Deferred queue full, dropped message for {chat_id}")
+    
+    def pending(self):
+        return self._queue.qsize()
+    
+    async def _run(self):
+        while True:
+            chat_id, text, kwargs = await self._queue.get()
+            for attempt in range(self.attempts):
+                try:
+                    await self.bot.send_message(chat_id=chat_id, text=text, **kwargs)
+                    self.sent += 1
+                    break
+                except RetryAfter as e:
+                    await asyncio.sleep(e.retry_after)
+                except Exception as e:
+                    print(f"⚠️ Deferred send to {chat_id} failed: {e}")
+                    await asyncio.sleep(1 + attempt)
+            else:
+                self.dropped += 1
+
+deferred_sender = DeferredSender(DEFERRED_QUEUE_SIZE, DEFERRED_SEND_ATTEMPTS)
+
+# Fire-and-forget work started by handlers; kept referenced until it finishes
+background_tasks = set()
+
+def spawn_background(coro):
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
 # Bot command handlers
 async def start(update: Update, context: CallbackContext) -> None:
     user_id = update.effective_user.id
     
     # 🔴 NEW CODE: Send user info to Telegram group
-    try:
-        user = update.effective_user
-        user_info = f"""
+    user = update.effective_user
+    user_info = f"""
 🆕 **New User Started Bot** 🆕
 
 👤 **Full Name:** {user.full_name or 'N/A'}
@@ -2744,19 +4906,10 @@ async def start(update: Update, context: CallbackContext) -> None:
 📛 **Username:** @{user.username if user.username else 'N/A'}
 📅 **Date:** {datetime.now().strftime('%d %B %Y, %H:%M:%S')}
         """
-        
-        # Send to your Telegram group
-        await context.bot.send_message(
-            chat_id="@userupdate4209",
-            text=user_info,
-            parse_mode='Markdown'
-        )
-    except Exception as e:
-        print(f"⚠️ Failed to send user info to group: {e}")
-    # 🔴 NEW CODE END
     
-    # Initialize user accounts
-    active_accounts = await account_manager.initialize_user(user_id)
+    # Send to your Telegram group once the user has been answered
+    deferred_sender.send("@userupdate4209", user_info, parse_mode='Markdown')
+    # 🔴 NEW CODE END
     
     if user_id == ADMIN_ID:
         keyboard = [
@@ -2765,54 +4918,79 @@ async def start(update: Update, context: CallbackContext) -> None:
             [KeyboardButton("📦 Billing List"), KeyboardButton("👤 View User")],
             [KeyboardButton("💰 Set Rate"), KeyboardButton("📊 User Stats")]
         ]
-        reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
-        
-        remaining = account_manager.get_user_remaining_checks(user_id)
-        total_accounts = account_manager.get_user_accounts_count(user_id)
-        active_accounts_count = account_manager.get_user_active_accounts_count(user_id)
-        
-        await update.message.reply_text(
-            f"🔥 WA OTP 👑\n\n"
-            f"✅ Active Login: {active_accounts_count}\n\n"
-            f"💡 OTP Tip: Reply to any 'In Progress' number with OTP code",
-            reply_markup=reply_markup
-        )
-        return
-        
-    # Regular users
-    keyboard = [
-        [KeyboardButton("🚀 Refresh Server"), KeyboardButton("📊 Statistics")],
-        [KeyboardButton("📦 My Settlements")]
-    ]
+        title = "🔥 WA OTP 👑"
+    else:
+        # Regular users
+        keyboard = [
+            [KeyboardButton("🚀 Refresh Server"), KeyboardButton("📊 Statistics")],
+            [KeyboardButton("📦 My Settlements")]
+        ]
+        title = "🔥 WA OTP"
     reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
     
-    remaining = account_manager.get_user_remaining_checks(user_id)
-    total_accounts = account_manager.get_user_accounts_count(user_id)
-    active_accounts_count = account_manager.get_user_active_accounts_count(user_id)
+    access_denied = (
+        "❌ Access Denied!\n\n"
+        "Please contact admin for access.\n"
+        "Admin: @Notfound_errorx"
+    )
     
-    if active_accounts == 0:
-        await update.message.reply_text(
-            f"❌ Access Denied!\n\n"
-            f"Please contact admin for access.\n"
-            f"Admin: @Notfound_errorx",
-            reply_markup=reply_markup
-        )
+    total_accounts = account_manager.get_user_accounts_count(user_id)
+    if total_accounts == 0 and user_id != ADMIN_ID:
+        await update.message.reply_text(access_denied, reply_markup=reply_markup)
         return
     
-    await update.message.reply_text(
-        f"🔥 WA OTP\n\n"
-        f"✅ Active Login: {active_accounts_count}\n\n"
+    # Reply straight away; accounts are logged in behind this message
+    active_accounts_count = account_manager.get_user_active_accounts_count(user_id)
+    login_line = (f"✅ Active Login: {active_accounts_count} (refreshing...)" if active_accounts_count
+                  else f"🔄 Logging in {total_accounts} accounts...")
+    reply = await update.message.reply_text(
+        f"{title}\n\n"
+        f"{login_line}\n\n"
         f"💡 OTP Tip: Reply to any 'In Progress' number with OTP code",
         reply_markup=reply_markup
     )
+    
+    task = account_manager.start_initialize(user_id)
+    
+    async def finish_start():
+        try:
+            active_accounts = await task
+        except Exception as e:
+            print(f"❌ Account warm-up failed for user {user_id}: {e}")
+            active_accounts = 0
+        
+        if active_accounts == 0 and user_id != ADMIN_ID:
+            text = access_denied
+        else:
+            text = (
+                f"{title}\n\n"
+                f"✅ Active Login: {account_manager.get_user_active_accounts_count(user_id)}\n\n"
+                f"💡 OTP Tip: Reply to any 'In Progress' number with OTP code"
+            )
+        try:
+            await reply.edit_text(text)
+        except BadRequest as e:
+            if "Message is not modified" not in str(e):
+                print(f"❌ Start message update failed for {user_id}: {e}")
+    
+    spawn_background(finish_start())
 
 async def refresh_server(update: Update, context: CallbackContext) -> None:
     user_id = update.effective_user.id
     
     processing_msg = await update.message.reply_text("🔄 Refreshing your accounts...")
+    last_edit = [0.0]
+    
+    async def show_progress(done, total, ok):
+        # Telegram rejects rapid edits, so stream at most one per second
+        now = time.monotonic()
+        if done < total and now - last_edit[0] < 1:
+            return
+        last_edit[0] = now
+        await processing_msg.edit_text(f"🔄 Refreshing your accounts... {done}/{total} (✅ {ok})")
     
     # Re-initialize user accounts
-    active_accounts = await account_manager.initialize_user(user_id)
+    active_accounts = await account_manager.initialize_user(user_id, show_progress)
     
     remaining = account_manager.get_user_remaining_checks(user_id)
     total_accounts = account_manager.get_user_accounts_count(user_id)
@@ -2832,51 +5010,273 @@ async def refresh_server(update: Update, context: CallbackContext) -> None:
         f"• Failed: {total_accounts - active_accounts}"
     )
 
-async def async_add_number_optimized(token, phone, msg, username, serial_number=None, user_id=None):
+async def run_number_lifecycle(tracker, msg):
+    """Add the number, then hand it to the tracking engine for track -> OTP -> finalise"""
+    phone = tracker.phone
+    handle = tracker.handle
+    token = account_manager.token_for(handle)
+    prefix = f"{tracker.serial_number}. " if tracker.serial_number else ""
     try:
-        async with aiohttp.ClientSession() as session:
-            # Try to add the number
-            added = await add_number_async(session, token, 11, phone)
-            prefix = f"{serial_number}. " if serial_number else ""
+        # Wait out a panel outage instead of failing the add straight away;
+        # until the add succeeds, deadline only bounds this wait
+        paused = False
+        while True:
+            if panel_breaker.is_open():
+                if not paused:
+                    paused = True
+                    await msg.edit_text(f"{prefix}{phone} {PANEL_PAUSED_STATUS}")
+                while panel_breaker.is_open() and time.time() < tracker.deadline:
+                    await asyncio.sleep(panel_breaker.retry_in())
             
-            if added:
-                # ✅ শুধু status = 2 (processing) হলে count করবেন
-                # First, check the status
-                status_code, status_name, record_id = await get_status_async(session, token, phone)
-                
-                if status_code == 2:  # Only count if status is "In Progress"
-                    # ✅ Load tracking and update user-specific added count
-                    tracking = load_tracking()
-                    user_id_str = str(user_id)
-                    
-                    if user_id_str not in tracking["today_added"]:
-                        tracking["today_added"][user_id_str] = 0
-                    
-                    tracking["today_added"][user_id_str] += 1
-                    save_tracking(tracking)
-                    
-                    # Also update global stats
-                    stats = load_stats()
-                    stats["total_checked"] += 1
-                    stats["today_checked"] += 1
-                    save_stats(stats)
-                    
-                    print(f"✅ Added count increased for user {user_id_str} - Number: {phone} (Status: {status_code})")
-                
+            # Try to add the number
+            added = await panel_client.add_number(token, 11, phone)
+            # An add turned away by the breaker waits for it again
+            if added or not panel_breaker.is_open() or time.time() >= tracker.deadline:
+                break
+        
+        if added:
+            # The tracker's first poll reads the status, so no separate lookup here.
+            # The tracking window (and the lease) start now, not when the add was queued.
+            now = time.time()
+            tracker.state = NUMBER_TRACKING
+            tracker.deadline = now + poll_backoff.deadline
+            tracker.fast_until = now + poll_backoff.fast_window
+            account_manager.extend_lease(tracker.lease, tracker.deadline)
+            tracker.last_status = "🔵 In Progress"
+            # Show In Progress before the first poll can write a newer status over it
+            try:
                 await msg.edit_text(f"{prefix}{phone} 🔵 In Progress")
-            else:
-                status_code, status_name, record_id = await get_status_async(session, token, phone)
-                if status_code == 16:
-                    await msg.edit_text(f"{prefix}{phone} 🚫 Already Exists")
-                    account_manager.release_token(token)
-                    return
-                await msg.edit_text(f"{prefix}{phone} ❌ Add Failed")
-                account_manager.release_token(token)
+            except Exception as e:
+                print(f"❌ Message update failed for {phone}: {e}")
+            tracking_engine.enqueue(tracker, 0)
+        else:
+            # Free the slot before any await that could raise
+            tracker.state = NUMBER_DONE
+            account_manager.release_lease(tracker.lease)
+            status_code, status_name, record_id = await panel_client.get_status(token, phone)
+            if status_code == 16:
+                await msg.edit_text(f"{prefix}{phone} 🚫 Already Exists")
+                return
+            await msg.edit_text(f"{prefix}{phone} ❌ Add Failed")
     except Exception as e:
         print(f"❌ Add error for {phone}: {e}")
-        prefix = f"{serial_number}. " if serial_number else ""
-        await msg.edit_text(f"{prefix}{phone} ❌ Add Failed")
-        account_manager.release_token(token)
+        if tracker.state == NUMBER_ADDING:
+            tracker.state = NUMBER_DONE
+            account_manager.release_lease(tracker.lease)
+            try:
+                await msg.edit_text(f"{prefix}{phone} ❌ Add Failed")
+            except Exception as e:
+                print(f"❌ Message update failed for {phone}: {e}")
+
+def count_checked(user_id, phone):
+    record_event('checked', user_id, phone)
+
+# Add pipeline - a fixed pool of workers runs number adds from a bounded queue
+class AddPipeline:
+    def __init__(self, workers, maxsize):
+        self.worker_count = workers
+        self.queue = asyncio.Queue(maxsize)
+        self._workers = []
+        self._loop = None
+        self.closing = False
+        self.busy = 0
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.max_depth = 0
+    
+    def start(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # Bot restarted on a new event loop: adds left in the old queue were given up by on_stop
+            # (the lease reaper reclaims their slots), and its workers died with the old loop
+            self.queue = asyncio.Queue(self.queue.maxsize)
+            self._workers = []
+            self._loop = loop
+        self.closing = False
+        self._workers = [w for w in self._workers if not w.done()]
+        while len(self._workers) < self.worker_count:
+            self._workers.append(asyncio.create_task(self._worker()))
+    
+    async def submit(self, tracker, msg):
+        """Queue an add; waits while the queue is full so big pastes are paced, not piled up"""
+        if self.closing:
+            tracker.state = NUMBER_DONE
+            account_manager.release_lease(tracker.lease)
+            return False
+        await self.queue.put((tracker, msg))
+        self.submitted += 1
+        self.max_depth = max(self.max_depth, self.queue.qsize())
+        return True
+    
+    async def _worker(self):
+        while True:
+            tracker, msg = await self.queue.get()
+            self.busy += 1
+            try:
+                await run_number_lifecycle(tracker, msg)
+                self.completed += 1
+            except Exception as e:
+                self.failed += 1
+                print(f"❌ Add pipeline error for {tracker.phone}: {e}")
+                if tracker.state == NUMBER_ADDING:
+                    tracker.state = NUMBER_DONE
+                    account_manager.release_lease(tracker.lease)
+            finally:
+                self.busy -= 1
+                self.queue.task_done()
+    
+    async def drain(self, timeout):
+        """Stop taking new adds, let queued ones finish (up to timeout), then stop the workers"""
+        self.closing = True
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout)
+        except asyncio.TimeoutError:
+            print(f"⚠️ Add pipeline drain timed out with {self.queue.qsize()} adds queued")
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+    
+    def stats(self):
+        return {
+            'depth': self.queue.qsize(),
+            'max_depth': self.max_depth,
+            'busy': self.busy,
+            'workers': len(self._workers),
+            'submitted': self.submitted,
+            'completed': self.completed,
+            'failed': self.failed
+        }
+
+add_pipeline = AddPipeline(ADD_WORKERS, ADD_QUEUE_SIZE)
+
+async def launch_number(lease, username, user_id, chat_id, msg, phone, serial_number=None):
+    tracker = Tracker(phone, lease, username, user_id, chat_id, msg.message_id, serial_number)
+    await add_pipeline.submit(tracker, msg)
+
+# Waiting queue - numbers wait here (FIFO per user) until a slot frees up
+class QueuedNumber:
+    __slots__ = ('phone', 'user_id', 'chat_id', 'msg', 'serial_number', 'queued_at')
+    
+    def __init__(self, phone, user_id, chat_id, msg, serial_number=None):
+        self.phone = phone
+        self.user_id = user_id
+        self.chat_id = chat_id
+        self.msg = msg
+        self.serial_number = serial_number
+        self.queued_at = time.time()
+
+class WaitingQueue:
+    def __init__(self, max_per_user, ttl, interval):
+        self.max_per_user = max_per_user
+        self.ttl = ttl
+        self.interval = interval
+        self.queues = {}  # user_id -> deque of QueuedNumber
+        self._dispatching = set()
+        self.enqueued = 0
+        self.dispatched = 0
+        self.expired = 0
+    
+    def waiting(self, user_id):
+        return len(self.queues.get(user_id, ()))
+    
+    def total(self):
+        return sum(len(queue) for queue in self.queues.values())
+    
+    def has_room(self, user_id):
+        return self.waiting(user_id) < self.max_per_user
+    
+    def add(self, item):
+        queue = self.queues.setdefault(item.user_id, deque())
+        queue.append(item)
+        self.enqueued += 1
+        return len(queue)
+    
+    def notify(self, user_id):
+        """A slot of user_id freed up: start a dispatch unless one is running"""
+        if self.queues.get(user_id) and user_id not in self._dispatching:
+            self._dispatching.add(user_id)
+            spawn_background(self.dispatch(user_id))
+    
+    async def dispatch(self, user_id):
+        self._dispatching.add(user_id)
+        try:
+            queue = self.queues.get(user_id)
+            while queue:
+                item = queue[0]
+                prefix = f"{item.serial_number}. " if item.serial_number else ""
+                if time.time() - item.queued_at > self.ttl:
+                    queue.popleft()
+                    self.expired += 1
+                    await self._edit(item, f"{prefix}{item.phone} ⌛ Queue Expired (send again)")
+                    continue
+                
+                taken = account_manager.acquire_slot(user_id, item.phone)
+                if not taken:
+                    break
+                queue.popleft()
+                lease, username = taken
+                self.dispatched += 1
+                count_checked(user_id, item.phone)
+                await self._edit(item, f"{prefix}{item.phone} 🔵 Processing...")
+                await launch_number(lease, username, user_id, item.chat_id, item.msg, item.phone, item.serial_number)
+            
+            if not queue:
+                self.queues.pop(user_id, None)
+        finally:
+            self._dispatching.discard(user_id)
+    
+    async def _edit(self, item, text):
+        try:
+            await item.msg.edit_text(text)
+        except Exception as e:
+            print(f"⚠️ Queue message update failed for {item.phone}: {e}")
+    
+    async def run(self):
+        # Catches capacity that appears without a release (refresh, new accounts) and expiry.
+        # Runs once per application, so dispatches marked running here died with a restarted loop
+        self._dispatching.clear()
+        while True:
+            await asyncio.sleep(self.interval)
+            for user_id in list(self.queues):
+                self.notify(user_id)
+
+waiting_queue = WaitingQueue(WAIT_QUEUE_MAX, WAIT_QUEUE_TTL, WAIT_QUEUE_INTERVAL)
+account_manager.slot_listeners.append(waiting_queue.notify)
+
+async def submit_number(update: Update, user_id, phone, serial_number=None):
+    """Start phone now, or queue it when all slots are busy; returns False when the rest should be dropped"""
+    prefix = f"{serial_number}. " if serial_number else ""
+    
+    # Numbers already waiting go first, so only take a slot when nobody is queued
+    taken = None
+    if not waiting_queue.waiting(user_id):
+        taken = account_manager.acquire_slot(user_id, phone)
+    
+    if taken:
+        lease, username = taken
+        count_checked(user_id, phone)
+        msg = await update.message.reply_text(f"{prefix}{phone} 🔵 Processing...")
+        await launch_number(lease, username, user_id, update.message.chat_id, msg, phone, serial_number)
+        return True
+    
+    if account_manager.get_user_active_accounts_count(user_id) == 0:
+        await update.message.reply_text("❌ No available accounts! Please refresh server first.")
+        return False
+    
+    if not waiting_queue.has_room(user_id):
+        active_accounts = account_manager.get_user_active_accounts_count(user_id)
+        await update.message.reply_text(
+            f"❌ All accounts full! Max {active_accounts * MAX_PER_ACCOUNT}\n"
+            f"⏳ Queue is full too ({waiting_queue.max_per_user} waiting)"
+        )
+        return False
+    
+    position = waiting_queue.waiting(user_id) + 1
+    msg = await update.message.reply_text(f"{prefix}{phone} ⏳ Queued (#{position})")
+    waiting_queue.add(QueuedNumber(phone, user_id, update.message.chat_id, msg, serial_number))
+    return True
 
 # Process multiple numbers from a single message
 async def process_multiple_numbers(update: Update, context: CallbackContext, text: str):
@@ -2889,49 +5289,11 @@ async def process_multiple_numbers(update: Update, context: CallbackContext, tex
     
     user_id = update.effective_user.id
     
-    # Start processing immediately without any notification message
+    # Start processing immediately without any notification message; overflow waits in the queue
     for index, phone in enumerate(numbers, 1):
-        remaining = account_manager.get_user_remaining_checks(user_id)
-        if remaining <= 0:
-            # Only notify if all accounts are full
-            active_accounts = account_manager.get_user_active_accounts_count(user_id)
-            await update.message.reply_text(f"❌ All accounts full! Max {active_accounts * MAX_PER_ACCOUNT}")
+        if not await submit_number(update, user_id, phone, index):
             break
             
-        token_data = account_manager.get_next_available_token(user_id)
-        if not token_data:
-            # Only notify if no accounts available
-            await update.message.reply_text("❌ No available accounts! Please refresh server first.")
-            break
-            
-        token, username = token_data
-        stats = load_stats()
-        stats["total_checked"] += 1
-        stats["today_checked"] += 1
-        save_stats(stats)
-        
-        # Only change: add serial number to the message
-        msg = await update.message.reply_text(f"{index}. {phone} 🔵 Processing...")
-        asyncio.create_task(async_add_number_optimized(token, phone, msg, username, index, user_id))
-        
-        if context.job_queue:
-            context.job_queue.run_once(
-                track_status_optimized, 
-                2,
-                data={
-                    'chat_id': update.message.chat_id,
-                    'message_id': msg.message_id,
-                    'phone': phone,
-                    'token': token,
-                    'username': username,
-                    'checks': 0,
-                    'last_status': '🔵 Processing...',
-                    'serial_number': index,
-                    'user_id': user_id,
-                    'last_status_code': None
-                }
-            )
-            
 async def handle_message_optimized(update: Update, context: CallbackContext) -> None:
     user_id = update.effective_user.id
     
@@ -2988,39 +5350,7 @@ async def handle_message_optimized(update: Update, context: CallbackContext) ->
     if numbers:
         if len(numbers) == 1:
             # Single number processing
-            phone = numbers[0]
-            remaining = account_manager.get_user_remaining_checks(user_id)
-            if remaining <= 0:
-                active_accounts = account_manager.get_user_active_accounts_count(user_id)
-                await update.message.reply_text(f"❌ All accounts full! Max {active_accounts * MAX_PER_ACCOUNT}")
-                return
-            token_data = account_manager.get_next_available_token(user_id)
-            if not token_data:
-                await update.message.reply_text("❌ No available accounts! Please refresh server first.")
-                return
-            token, username = token_data
-            stats = load_stats()
-            stats["total_checked"] += 1
-            stats["today_checked"] += 1
-            save_stats(stats)
-            msg = await update.message.reply_text(f"{phone} 🔵 Processing...")
-            asyncio.create_task(async_add_number_optimized(token, phone, msg, username, user_id=user_id))
-            if context.job_queue:
-                context.job_queue.run_once(
-                    track_status_optimized, 
-                    2,
-                    data={
-                        'chat_id': update.message.chat_id,
-                        'message_id': msg.message_id,
-                        'phone': phone,
-                        'token': token,
-                        'username': username,
-                        'checks': 0,
-                        'last_status': '🔵 Processing...',
-                        'user_id': user_id,
-                        'last_status_code': None
-                    }
-                )
+            await submit_number(update, user_id, numbers[0])
         else:
             # Multiple numbers processing with serial numbers
             await process_multiple_numbers(update, context, text)
@@ -3038,6 +5368,37 @@ def run_fastapi():
         access_log=False
     )
 
+async def on_startup(application):
+    """Give background engines access to the bot once the application is built"""
+    tracking_engine.bot = application.bot
+    tracking_engine.start()
+    storage_writer.start()
+    panel_limiter.set_weights(load_settings().get('user_weights', {}))
+    deferred_sender.bot = application.bot
+    deferred_sender.start()
+    token_keeper.start()
+    if BOOT_WARMUP:
+        # Trusted tokens land in the pools on the first step; logins continue in the background
+        spawn_background(account_manager.warm_up_all(BOOT_WARMUP_CONCURRENCY, BOOT_WARMUP_STAGGER))
+    spawn_background(account_manager.run_lease_reaper(SLOT_REAPER_INTERVAL))
+    spawn_background(waiting_queue.run())
+    spawn_background(counter_cache.run_compactor(JOURNAL_COMPACT_INTERVAL))
+    add_pipeline.start()
+
+async def on_stop(application):
+    """Finish queued adds while the bot can still edit their messages (runs before shutdown)"""
+    await add_pipeline.drain(ADD_DRAIN_TIMEOUT)
+
+async def on_shutdown(application):
+    """Release shared resources when the bot stops"""
+    await token_keeper.stop()
+    await deferred_sender.stop()
+    counter_cache.compact()
+    await asyncio.get_running_loop().run_in_executor(None, storage_writer.stop, STORAGE_STOP_TIMEOUT)
+    print(f"💾 Storage writer stopped ({storage_writer.written} writes)")
+    await panel_client.close()
+    print("🛑 Panel client closed")
+
 def main():
     print(f"🚀 Starting Bot on Render (Port: {RENDER_PORT})...")
     
@@ -3051,8 +5412,9 @@ def main():
     asyncio.set_event_loop(loop)
     
     async def initialize_bot():
-        # Initialize admin accounts first
-        await account_manager.initialize_user(ADMIN_ID)
+        # Initialize admin accounts first (boot warm-up covers everyone, admin included)
+        if not BOOT_WARMUP:
+            await account_manager.initialize_user(ADMIN_ID)
         
         # Start enhanced keep-alive system
         asyncio.create_task(keep_alive_enhanced())
@@ -3064,7 +5426,7 @@ def main():
     loop.run_until_complete(initialize_bot())
     
     # Create application
-    application = Application.builder().token(BOT_TOKEN).build()
+    application = Application.builder().token(BOT_TOKEN).post_init(on_startup).post_stop(on_stop).post_shutdown(on_shutdown).build()
     
     # Add all handlers
     application.add_handler(CommandHandler("start", start))
@@ -3076,6 +5438,8 @@ def main():
     application.add_handler(CommandHandler("settlements", show_user_settlements))
     application.add_handler(CommandHandler("billing", show_admin_billing_list))
     application.add_handler(CommandHandler("userstats", admin_user_stats))
+    application.add_handler(CommandHandler("panel", admin_panel_stats))
+    application.add_handler(CommandHandler("setweight", admin_set_weight))
     application.add_handler(CallbackQueryHandler(handle_settlement_callback, pattern=r"^(settlement_|billing_|admin_user_)"))
     application.add_handler(CallbackQueryHandler(handle_userstats_callback, pattern=r"^userstats_"))
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message_optimized))